@@ -0,0 +1,95 @@
+"""mpesa callback idempotency
+
+Revision ID: c4a2e9f17b85
+Revises: 8b3f0d6e4a17
+Create Date: 2026-10-18 14:05:51.227390
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a2e9f17b85'
+down_revision: Union[str, None] = '8b3f0d6e4a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _clear_duplicates(column: str) -> None:
+    # Callbacks only ever matched the first payment with a given id, so later
+    # duplicates are orphans; clear their value so the unique index can build.
+    op.execute(
+        f"""
+        UPDATE payments SET {column} = NULL
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY {column} ORDER BY id) AS rn
+                FROM payments WHERE {column} IS NOT NULL
+            ) ranked
+            WHERE rn > 1
+        )
+        """
+    )
+
+
+def _check_receipt_duplicates() -> None:
+    # Receipt numbers are M-Pesa's proof of payment, so they are never
+    # rewritten here: duplicates must be resolved by hand before upgrading.
+    if context.is_offline_mode():
+        return
+    rows = op.get_bind().execute(sa.text(
+        """
+        SELECT mpesa_receipt_number, id FROM payments
+        WHERE mpesa_receipt_number IN (
+            SELECT mpesa_receipt_number FROM payments
+            WHERE mpesa_receipt_number IS NOT NULL
+            GROUP BY mpesa_receipt_number HAVING count(*) > 1
+        )
+        ORDER BY mpesa_receipt_number, id
+        """
+    )).all()
+    if rows:
+        duplicates = {}
+        for receipt, payment_id in rows:
+            duplicates.setdefault(receipt, []).append(payment_id)
+        report = "; ".join(f"{receipt}: payments {ids}" for receipt, ids in duplicates.items())
+        raise RuntimeError(
+            f"{len(duplicates)} M-Pesa receipt numbers are shared by several payments, "
+            f"so ix_payments_mpesa_receipt_number cannot be created. Resolve them first: {report}"
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _check_receipt_duplicates()
+    _clear_duplicates('checkout_request_id')
+    op.create_index(op.f('ix_payments_checkout_request_id'), 'payments', ['checkout_request_id'], unique=True)
+    op.create_index(op.f('ix_payments_mpesa_receipt_number'), 'payments', ['mpesa_receipt_number'], unique=True)
+
+    op.create_table('mpesa_callback_log',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('checkout_request_id', sa.String(), nullable=True),
+    sa.Column('result_code', sa.Integer(), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.Column('outcome', sa.String(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_mpesa_callback_log_id'), 'mpesa_callback_log', ['id'], unique=False)
+    op.create_index(op.f('ix_mpesa_callback_log_checkout_request_id'), 'mpesa_callback_log', ['checkout_request_id'], unique=False)
+    op.create_index('ix_mpesa_callback_log_unprocessed', 'mpesa_callback_log', ['id'], unique=False, postgresql_where=sa.text('processed_at IS NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_mpesa_callback_log_unprocessed', table_name='mpesa_callback_log')
+    op.drop_index(op.f('ix_mpesa_callback_log_checkout_request_id'), table_name='mpesa_callback_log')
+    op.drop_index(op.f('ix_mpesa_callback_log_id'), table_name='mpesa_callback_log')
+    op.drop_table('mpesa_callback_log')
+    op.drop_index(op.f('ix_payments_mpesa_receipt_number'), table_name='payments')
+    op.drop_index(op.f('ix_payments_checkout_request_id'), table_name='payments')
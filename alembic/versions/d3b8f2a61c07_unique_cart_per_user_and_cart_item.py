@@ -0,0 +1,84 @@
+"""unique cart per user and cart item per product
+
+Revision ID: d3b8f2a61c07
+Revises: c4a2e9f17b85
+Create Date: 2026-10-18 20:41:09.518244
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3b8f2a61c07'
+down_revision: Union[str, None] = 'c4a2e9f17b85'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _merge_duplicate_carts() -> None:
+    # Keep each user's oldest cart: move the other carts' items into it, then drop them
+    op.execute(
+        """
+        UPDATE cart_items SET cart_id = dup.keep_id
+        FROM (
+            SELECT id, min(id) OVER (PARTITION BY user_id) AS keep_id
+            FROM carts WHERE user_id IS NOT NULL
+        ) dup
+        WHERE cart_items.cart_id = dup.id AND dup.id <> dup.keep_id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM carts WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY id) AS rn
+                FROM carts WHERE user_id IS NOT NULL
+            ) ranked
+            WHERE rn > 1
+        )
+        """
+    )
+
+
+def _merge_duplicate_cart_items() -> None:
+    # Same product twice in a cart (racing adds): keep the first row with the summed quantity
+    op.execute(
+        """
+        UPDATE cart_items SET quantity = dup.total
+        FROM (
+            SELECT min(id) AS keep_id, sum(quantity) AS total
+            FROM cart_items
+            GROUP BY cart_id, product_id
+            HAVING count(*) > 1
+        ) dup
+        WHERE cart_items.id = dup.keep_id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM cart_items WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY cart_id, product_id ORDER BY id) AS rn
+                FROM cart_items
+            ) ranked
+            WHERE rn > 1
+        )
+        """
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _merge_duplicate_carts()
+    _merge_duplicate_cart_items()
+    op.create_index(op.f('ix_carts_user_id'), 'carts', ['user_id'], unique=True)
+    op.create_unique_constraint('uq_cart_items_cart_id_product_id', 'cart_items', ['cart_id', 'product_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_cart_items_cart_id_product_id', 'cart_items', type_='unique')
+    op.drop_index(op.f('ix_carts_user_id'), table_name='carts')
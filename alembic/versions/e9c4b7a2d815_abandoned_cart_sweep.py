@@ -0,0 +1,47 @@
+"""abandoned cart sweep
+
+Revision ID: e9c4b7a2d815
+Revises: d3b8f2a61c07
+Create Date: 2026-10-18 21:02:44.170835
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9c4b7a2d815'
+down_revision: Union[str, None] = 'd3b8f2a61c07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_carts_updated_at'), 'carts', ['updated_at'], unique=False)
+    op.create_table('abandoned_carts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cart_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('line_count', sa.Integer(), nullable=False),
+    sa.Column('unit_count', sa.Integer(), nullable=False),
+    sa.Column('subtotal', sa.Float(), nullable=False),
+    sa.Column('last_activity_at', sa.DateTime(), nullable=True),
+    sa.Column('swept_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_abandoned_carts_id'), 'abandoned_carts', ['id'], unique=False)
+    op.create_index(op.f('ix_abandoned_carts_user_id'), 'abandoned_carts', ['user_id'], unique=False)
+    op.create_index(op.f('ix_abandoned_carts_swept_at'), 'abandoned_carts', ['swept_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_abandoned_carts_swept_at'), table_name='abandoned_carts')
+    op.drop_index(op.f('ix_abandoned_carts_user_id'), table_name='abandoned_carts')
+    op.drop_index(op.f('ix_abandoned_carts_id'), table_name='abandoned_carts')
+    op.drop_table('abandoned_carts')
+    op.drop_index(op.f('ix_carts_updated_at'), table_name='carts')
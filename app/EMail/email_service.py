@@ -31,37 +31,183 @@
 
 # app/EMail/email_service.py
 
+import asyncio
+import re
 import smtplib
+import time
 
 import os
-from typing import List, Union
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from email.message import EmailMessage
 from dotenv import load_dotenv
 
 # Load .env variables
 load_dotenv()
 
-EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
-EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
-
-def send_email(subject: str, recipients: Union[str, List[str]], body_html: str):
-    if isinstance(recipients, str):
-        recipients = [recipients]
-
-    if not EMAIL_HOST_USER or not EMAIL_HOST_PASSWORD:
-        raise ValueError("Missing EMAIL_HOST_USER or EMAIL_HOST_PASSWORD")
-
-    msg = MIMEMultipart()
-    msg["From"] = EMAIL_HOST_USER
-    msg["To"] = ", ".join(recipients)
-    msg["Subject"] = subject
-    msg.attach(MIMEText(body_html, "html"))
-
-    try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(EMAIL_HOST_USER, EMAIL_HOST_PASSWORD)
-            server.sendmail(EMAIL_HOST_USER, recipients, msg.as_string())
-    except Exception as e:
-        print("Failed to send email:", e)
+# --- SMTP settings ---
+# Deployments configure mail either with EMAIL_HOST_USER/EMAIL_HOST_PASSWORD
+# (Gmail unless EMAIL_HOST says otherwise) or with the SMTP_* settings the OTP
+# mail used. An explicit EMAIL_HOST selects the first set; otherwise a set
+# SMTP_SERVER selects the second, so host and credentials never get mixed.
+if os.getenv("EMAIL_HOST") or not os.getenv("SMTP_SERVER"):
+    EMAIL_HOST = os.getenv("EMAIL_HOST", "smtp.gmail.com")
+    EMAIL_PORT = int(os.getenv("EMAIL_PORT", 587))
+    EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
+    EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
+    EMAIL_FROM = os.getenv("EMAIL_FROM") or EMAIL_HOST_USER
+else:
+    EMAIL_HOST = os.getenv("SMTP_SERVER")
+    EMAIL_PORT = int(os.getenv("SMTP_PORT", 587))
+    EMAIL_HOST_USER = os.getenv("SMTP_USERNAME")
+    EMAIL_HOST_PASSWORD = os.getenv("SMTP_PASSWORD")
+    EMAIL_FROM = os.getenv("SMTP_FROM_EMAIL") or EMAIL_HOST_USER
+
+# --- Pooled SMTP delivery (used by the outbox worker) ---
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "true").lower() in ("1", "true", "yes", "on")
+EMAIL_SMTP_TIMEOUT = float(os.getenv("EMAIL_SMTP_TIMEOUT", 30))
+# Close the connection after this long unused; servers drop idle sessions anyway
+EMAIL_SMTP_IDLE_SECONDS = float(os.getenv("EMAIL_SMTP_IDLE_SECONDS", 60))
+
+# Rejections of a single message; the session stays usable. Any other
+# error (SMTPException is an OSError) ends the batch on this connection.
+_MESSAGE_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+    smtplib.SMTPNotSupportedError,
+)
+
+_LINE_BREAKS = re.compile(r"\s*[\r\n]+\s*")
+
+
+def _header_value(value: Optional[str]) -> Optional[str]:
+    # A CR/LF in a header (e.g. a customer name in the subject) makes
+    # EmailMessage refuse it; fold it to a space instead
+    return _LINE_BREAKS.sub(" ", value).strip() if value else value
+
+
+def build_message(
+    subject: str,
+    recipients: List[str],
+    body_html: str,
+    body_text: Optional[str] = None,
+    sender: Optional[str] = EMAIL_FROM,
+) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = _header_value(sender)
+    msg["To"] = ", ".join(_header_value(r) for r in recipients)
+    msg["Subject"] = _header_value(subject)
+    if body_text:
+        msg.set_content(body_text)
+        msg.add_alternative(body_html, subtype="html")
+    else:
+        msg.set_content(body_html, subtype="html")
+    return msg
+
+
+class SmtpMailer:
+    """Sends messages over one authenticated SMTP connection that is kept open.
+
+    STARTTLS and LOGIN happen once per connection instead of once per
+    message. smtplib is blocking and not thread-safe, so all SMTP work runs
+    on a single dedicated thread. A dropped connection is reopened once
+    per message.
+    """
+
+    def __init__(
+        self,
+        host: str = EMAIL_HOST,
+        port: int = EMAIL_PORT,
+        username: Optional[str] = EMAIL_HOST_USER,
+        password: Optional[str] = EMAIL_HOST_PASSWORD,
+        use_tls: bool = EMAIL_USE_TLS,
+        timeout: float = EMAIL_SMTP_TIMEOUT,
+        idle_seconds: float = EMAIL_SMTP_IDLE_SECONDS,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        # Created on first send and dropped by aclose(), so a closed mailer can be reused
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self.connections_opened = 0
+
+    # --- worker thread only ---
+    def _close(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._smtp = None
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_seconds:
+            self._close()
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                if self.use_tls:
+                    smtp.starttls()
+                if self.username and self.password:
+                    smtp.login(self.username, self.password)
+            except BaseException:
+                smtp.close()
+                raise
+            self._smtp = smtp
+            self._last_used = time.monotonic()
+            self.connections_opened += 1
+        return self._smtp
+
+    def _send_one(self, message: EmailMessage) -> None:
+        try:
+            self._connection().send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # Server closed an idle session between batches: reconnect once
+            self._close()
+            self._connection().send_message(message)
+        finally:
+            if self._smtp is not None:
+                self._last_used = time.monotonic()
+
+    def _send_batch(self, messages: List[EmailMessage]) -> List[Optional[str]]:
+        errors: List[Optional[str]] = []
+        for i, message in enumerate(messages):
+            try:
+                self._send_one(message)
+                errors.append(None)
+            except _MESSAGE_ERRORS as e:
+                errors.append(f"{type(e).__name__}: {e}")
+            except OSError as e:
+                self._close()
+                error = f"{type(e).__name__}: {e}"
+                errors.extend([error] * (len(messages) - i))
+                break
+            except Exception as e:
+                # Anything else is this message's fault; start the next one on a fresh session
+                self._close()
+                errors.append(f"{type(e).__name__}: {e}")
+        return errors
+
+    # --- event loop side ---
+    async def send_batch(self, messages: List[EmailMessage]) -> List[Optional[str]]:
+        """Send ``messages`` in order; returns None or an error string per message."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smtp")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._send_batch, messages)
+
+    async def aclose(self) -> None:
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self._close)
+        executor.shutdown(wait=False)
@@ -1,4 +1,94 @@
-from typing import List
+import os
+from collections import OrderedDict
+from typing import Hashable, List, Tuple
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, select_autoescape
+from markupsafe import Markup
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+EMAIL_FRAGMENT_CACHE_SIZE = int(os.getenv("EMAIL_FRAGMENT_CACHE_SIZE", 2048))
+
+# Templates are read from disk and compiled once, when this module is
+# imported at startup; auto_reload is off so renders never stat the files.
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=select_autoescape(enabled_extensions=("html",), default_for_string=False),
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+    undefined=StrictUndefined,
+)
+_templates = {
+    name: _env.get_template(name)
+    for name in (
+        "order_email.html",
+        "order_email.txt",
+        "product_card.html",
+        "otp_email.html",
+        "otp_email.txt",
+        "payment_receipt.html",
+        "payment_receipt.txt",
+    )
+}
+
+
+class FragmentCache:
+    """Small LRU of rendered HTML fragments."""
+
+    def __init__(self, max_entries: int = EMAIL_FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Markup]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: Hashable, render) -> Markup:
+        fragment = self._entries.get(key)
+        if fragment is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fragment
+        self.misses += 1
+        fragment = Markup(render())
+        self._entries[key] = fragment
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return fragment
+
+
+product_cards = FragmentCache()
+
+
+def _product_card(item: dict) -> Markup:
+    # Keyed on exactly what the card renders. Not on updated_at: stock
+    # reservations bump it on every order, which would defeat the cache.
+    name, price, image_url = item["name"], item["price"], item.get("image_url")
+
+    def render():
+        return _templates["product_card.html"].render(name=name, price=price, image_url=image_url)
+
+    return product_cards.get_or_render((name, price, image_url), render)
+
+
+def render_order_email(
+    customer_name: str,
+    email: str,
+    phone: str,
+    shipping: str,
+    total: float,
+    items: List[dict],
+) -> Tuple[str, str]:
+    """Return (html, plain text) for an order notification.
+
+    ``items`` are dicts with name, quantity, price and image_url.
+    """
+    context = dict(
+        customer_name=customer_name, email=email, phone=phone, shipping=shipping, total=total,
+    )
+    lines = [dict(item, card=_product_card(item)) for item in items]
+    html = _templates["order_email.html"].render(items=lines, **context)
+    text = _templates["order_email.txt"].render(items=items, **context)
+    return html, text
+
 
 def generate_order_email_body(
     customer_name: str,
@@ -9,56 +99,25 @@ def generate_order_email_body(
     items: List[dict],
 ) -> str:
     """Return a styled HTML order‑notification email."""
-    # Build each item block with thumbnail
-    item_blocks = ""
-    for item in items:
-        img_tag = (
-            f'<img src="{item["image_url"]}" alt="{item["name"]}" '
-            f'style="width:110px;height:auto;border-radius:8px;margin-right:14px;" />'
-            if item.get("image_url")
-            else ""
-        )
-
-        item_blocks += f"""
-        <div style="display:flex;align-items:center;padding:12px 14px;background:#fff;border-radius:10px;
-                    box-shadow:0 2px 5px rgba(0,0,0,0.06);margin-bottom:14px;">
-            {img_tag}
-            <div style="flex:1;">
-                <div style="font-size:15px;font-weight:600;color:#222;">{item['name']}</div>
-                <div style="color:#555;font-size:14px;">Qty: {item['quantity']}</div>
-                <div style="color:#555;font-size:14px;">
-                    Price: <strong style="color:#f97316;">KES {item['price']}</strong>
-                </div>
-            </div>
-        </div>
-        """
-
-    # Main email wrapper
-    return f"""
-    <div style="max-width:620px;margin:auto;background:#fafafa;padding:28px;border-radius:14px;
-                font-family:Arial,Helvetica,sans-serif;color:#333;">
-        <!-- Header -->
-        <h2 style="color:#f97316;margin-top:0;margin-bottom:10px;">🛒 New Order Received</h2>
-
-        <!-- Customer / shipping details -->
-        <p style="margin:4px 0;"><strong>Name:</strong> {customer_name}</p>
-        <p style="margin:4px 0;"><strong>Email:</strong> {email}</p>
-        <p style="margin:4px 0;"><strong>Phone:</strong> {phone}</p>
-        <p style="margin:4px 0;"><strong>Shipping Address:</strong> {shipping}</p>
-        <p style="margin:8px 0 20px 0;font-size:16px;">
-            <strong>Total Amount:</strong>
-            <span style="color:#f97316;font-weight:bold;">KES {total}</span>
-        </p>
-
-        <!-- Order items -->
-        <h3 style="color:#f97316;margin-bottom:12px;">🧾 Order Items</h3>
-        {item_blocks}
-
-        <!-- Thank‑you note -->
-        <p style="text-align:center;margin-top:26px;font-size:14px;
-                  color:#27ae60;font-weight:600;">
-            🎉 Thank you for choosing <span style="color:#f97316;">Smart&nbsp;Indoor&nbsp;Decors</span> –<br/>
-            your trusted e‑commerce partner! We hope these items brighten your space. 🌿
-        </p>
-    </div>
-    """
+    return render_order_email(customer_name, email, phone, shipping, total, items)[0]
+
+
+def render_otp_email(otp: str) -> Tuple[str, str]:
+    """Return (html, plain text) for the password reset OTP email."""
+    return (
+        _templates["otp_email.html"].render(otp=otp),
+        _templates["otp_email.txt"].render(otp=otp),
+    )
+
+
+def render_payment_receipt(
+    customer_name: str, order_id: int, receipt_number: str, amount: float
+) -> Tuple[str, str]:
+    """Return (html, plain text) for the customer's M-Pesa payment receipt."""
+    context = dict(
+        customer_name=customer_name, order_id=order_id, receipt_number=receipt_number, amount=amount,
+    )
+    return (
+        _templates["payment_receipt.html"].render(**context),
+        _templates["payment_receipt.txt"].render(**context),
+    )
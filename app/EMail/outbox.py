@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Union
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.connection import AsyncSessionLocal
+from app.EMail.email_service import SmtpMailer, build_message
+from app.models.models import EmailOutbox
+
+log = logging.getLogger(__name__)
+
+EMAIL_OUTBOX_ENABLED = os.getenv("EMAIL_OUTBOX_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", 20))
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", 5))
+# A claimed row is retried by any worker once its lease runs out (crash safety)
+EMAIL_OUTBOX_LEASE_SECONDS = float(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", 300))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", 6))
+EMAIL_OUTBOX_BACKOFF_SECONDS = float(os.getenv("EMAIL_OUTBOX_BACKOFF_SECONDS", 30))
+EMAIL_OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("EMAIL_OUTBOX_BACKOFF_MAX_SECONDS", 3600))
+
+PENDING = "PENDING"
+SENDING = "SENDING"
+SENT = "SENT"
+FAILED = "FAILED"
+
+
+def enqueue_email(
+    db: AsyncSession,
+    subject: str,
+    recipients: Union[str, List[str]],
+    body_html: str,
+    body_text: Optional[str] = None,
+) -> EmailOutbox:
+    """Add an email to the outbox as part of the caller's transaction.
+
+    Nothing is sent until the caller commits, so an email is never sent for
+    a rolled-back change and never lost once it is committed. Call
+    ``email_worker.wake()`` after the commit for prompt delivery.
+    """
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    row = EmailOutbox(
+        recipients=",".join(recipients),
+        subject=subject,
+        body_html=body_html,
+        body_text=body_text,
+        status=PENDING,
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(row)
+    return row
+
+
+async def claim_emails(db: AsyncSession, limit: int, lease_seconds: float) -> List[EmailOutbox]:
+    """Lease up to ``limit`` due emails to this worker.
+
+    Rows are picked with FOR UPDATE SKIP LOCKED so concurrent workers never
+    claim the same message. SENDING rows whose lease expired (the worker
+    died mid-batch) are picked up again.
+    """
+    now = datetime.utcnow()
+    due = (
+        select(EmailOutbox.id)
+        .where(
+            or_(
+                (EmailOutbox.status == PENDING) & (EmailOutbox.next_attempt_at <= now),
+                (EmailOutbox.status == SENDING) & (EmailOutbox.locked_until < now),
+            )
+        )
+        .order_by(EmailOutbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.id.in_(due.scalar_subquery()))
+        .values(
+            status=SENDING,
+            locked_until=now + timedelta(seconds=lease_seconds),
+            attempts=EmailOutbox.attempts + 1,
+            updated_at=now,
+        )
+        .returning(EmailOutbox)
+        .execution_options(synchronize_session=False)
+    )
+    return sorted(result.scalars().all(), key=lambda row: row.id)
+
+
+class EmailOutboxWorker:
+    """Background task that drains the email outbox.
+
+    Each round claims a batch, sends it over the mailer's persistent SMTP
+    connection and records the outcome per message. Failed messages are
+    retried with exponential backoff until ``max_attempts``, then marked
+    FAILED with the last error kept.
+    """
+
+    def __init__(
+        self,
+        mailer: SmtpMailer,
+        session_factory=AsyncSessionLocal,
+        batch_size: int = EMAIL_OUTBOX_BATCH_SIZE,
+        poll_seconds: float = EMAIL_OUTBOX_POLL_SECONDS,
+        lease_seconds: float = EMAIL_OUTBOX_LEASE_SECONDS,
+        max_attempts: int = EMAIL_OUTBOX_MAX_ATTEMPTS,
+    ):
+        self.mailer = mailer
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @staticmethod
+    def backoff(attempts: int) -> timedelta:
+        delay = EMAIL_OUTBOX_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0)
+        return timedelta(seconds=min(delay, EMAIL_OUTBOX_BACKOFF_MAX_SECONDS))
+
+    def wake(self) -> None:
+        """Start the next round now instead of at the next poll."""
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            # Bound to the running loop on first wait, so each start gets its own
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="email-outbox")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.mailer.aclose()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Email outbox round failed")
+                processed = 0
+            if processed < self.batch_size:
+                # Drained: sleep until woken or the next poll
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def run_once(self) -> int:
+        """Claim, send and settle one batch; returns the number of emails handled."""
+        async with self.session_factory() as db:
+            rows = await claim_emails(db, self.batch_size, self.lease_seconds)
+            # Read everything needed before commit expires the rows
+            handled = len(rows)
+            claimed, messages = [], []
+            now = datetime.utcnow()
+            for row in rows:
+                try:
+                    message = build_message(row.subject, row.recipients.split(","), row.body_html, row.body_text)
+                except Exception as e:
+                    # Malformed row: retrying cannot fix it, and it must not hold up the batch
+                    error = f"{type(e).__name__}: {e}"
+                    self.failed += 1
+                    log.error("Giving up on email %s, cannot build it: %s", row.id, error)
+                    await db.execute(
+                        update(EmailOutbox)
+                        .where(EmailOutbox.id == row.id)
+                        .values(status=FAILED, locked_until=None, last_error=error[:1000], updated_at=now)
+                        .execution_options(synchronize_session=False)
+                    )
+                    continue
+                claimed.append((row.id, row.attempts))
+                messages.append(message)
+            await db.commit()
+        if not claimed:
+            return handled
+
+        errors = await self.mailer.send_batch(messages)
+
+        now = datetime.utcnow()
+        sent_ids = [row_id for (row_id, _), error in zip(claimed, errors) if error is None]
+        async with self.session_factory() as db:
+            if sent_ids:
+                await db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id.in_(sent_ids))
+                    .values(status=SENT, sent_at=now, locked_until=None, last_error=None, updated_at=now)
+                )
+            for (row_id, attempts), error in zip(claimed, errors):
+                if error is None:
+                    continue
+                if attempts >= self.max_attempts:
+                    values = dict(status=FAILED)
+                    self.failed += 1
+                    log.error("Giving up on email %s after %s attempts: %s", row_id, attempts, error)
+                else:
+                    values = dict(status=PENDING, next_attempt_at=now + self.backoff(attempts))
+                    self.retried += 1
+                    log.warning("Email %s failed (attempt %s), will retry: %s", row_id, attempts, error)
+                await db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id == row_id)
+                    .values(locked_until=None, last_error=error[:1000], updated_at=now, **values)
+                )
+            await db.commit()
+        self.sent += len(sent_ids)
+        return handled
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "smtp_connections_opened": self.mailer.connections_opened,
+        }
+
+
+email_worker = EmailOutboxWorker(SmtpMailer())
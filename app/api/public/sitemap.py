@@ -1,63 +1,220 @@
-from fastapi import APIRouter, Depends
-from fastapi.responses import Response
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+import os
 from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 
-from app.database.connection import get_db
+from app.database.connection import AsyncSessionLocal, get_db
 from app.models.models import Product
+from app.utils.cache import SITEMAP_TAG, response_cache
+from app.utils.http_cache import is_not_modified, not_modified_response, validator_headers
 
 router = APIRouter()
 
+SITE_URL = os.getenv("SITE_URL", "https://www.smartindoordecors.com")
+# The sitemap protocol allows at most 50,000 URLs per file
+SITEMAP_MAX_URLS = int(os.getenv("SITEMAP_MAX_URLS", 50000))
+SITEMAP_CACHE_TTL = float(os.getenv("SITEMAP_CACHE_TTL", 3600))
+SITEMAP_STREAM_BATCH = int(os.getenv("SITEMAP_STREAM_BATCH", 1000))
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+URLSET_OPEN = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+URLSET_CLOSE = "</urlset>\n"
+
+# Static routes
+STATIC_ROUTES = [
+    {"loc": f"{SITE_URL}/", "priority": "1.0", "changefreq": "daily"},
+    {"loc": f"{SITE_URL}/shop", "priority": "0.8", "changefreq": "daily"},
+    {"loc": f"{SITE_URL}/about", "priority": "0.5", "changefreq": "monthly"},
+    {"loc": f"{SITE_URL}/blog", "priority": "0.6", "changefreq": "weekly"},
+    {"loc": f"{SITE_URL}/faq", "priority": "0.6", "changefreq": "monthly"},
+    {"loc": f"{SITE_URL}/terms", "priority": "0.4", "changefreq": "yearly"},
+    {"loc": f"{SITE_URL}/privacy", "priority": "0.4", "changefreq": "yearly"},
+    {"loc": f"{SITE_URL}/services", "priority": "0.5", "changefreq": "monthly"},
+    {"loc": f"{SITE_URL}/contact", "priority": "0.5", "changefreq": "monthly"},
+    {"loc": f"{SITE_URL}/testimonials", "priority": "0.5", "changefreq": "monthly"},
+]
+# Product shard n holds the in-stock products with id in [n * size, (n + 1) * size),
+# so a shard never exceeds the limit and its contents don't shift as products come and go.
+PRODUCT_SHARD_SIZE = SITEMAP_MAX_URLS
+
+
+def _url(loc: str, lastmod: Optional[datetime], changefreq: str, priority: str) -> str:
+    lastmod_tag = f"<lastmod>{lastmod.date().isoformat()}</lastmod>" if lastmod else ""
+    return (
+        f"<url><loc>{loc}</loc>{lastmod_tag}"
+        f"<changefreq>{changefreq}</changefreq><priority>{priority}</priority></url>\n"
+    )
+
+
+def _static_urls(today: datetime) -> str:
+    return "".join(_url(r["loc"], today, r["changefreq"], r["priority"]) for r in STATIC_ROUTES)
+
+
+def _today() -> datetime:
+    return datetime.combine(datetime.utcnow().date(), datetime.min.time())
+
+
+def _cache_ttl(today: datetime) -> float:
+    # Static URLs carry today's date, so nothing cached outlives the day
+    seconds_left = 86400 - (datetime.utcnow() - today).total_seconds()
+    return max(min(SITEMAP_CACHE_TTL, seconds_left), 1)
+
+
+def _in_stock(shard: Optional[int] = None):
+    query_filter = [Product.stock > 0]
+    if shard is not None:
+        query_filter += [
+            Product.id >= shard * PRODUCT_SHARD_SIZE,
+            Product.id < (shard + 1) * PRODUCT_SHARD_SIZE,
+        ]
+    return query_filter
+
+
+async def _stream_product_urls(shard: Optional[int]) -> AsyncIterator[str]:
+    # Own session: the request's session is closed before a streamed body is sent
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            select(Product.id, Product.updated_at)
+            .where(*_in_stock(shard))
+            .order_by(Product.id)
+            .execution_options(yield_per=SITEMAP_STREAM_BATCH)
+        )
+        async for rows in result.partitions():
+            yield "".join(
+                _url(f"{SITE_URL}/product/{product_id}", updated_at, "weekly", "0.9")
+                for product_id, updated_at in rows
+            )
+
+
+async def _cached_or_streamed(
+    request: Request, headers: Dict[str, str], ttl: float, generation: Optional[int], parts
+) -> Response:
+    """Stream ``parts`` (str chunks) to the client and cache the finished document.
+
+    Not cached if a product change invalidated the sitemaps after
+    ``generation`` was read, since the document may predate it.
+    """
+
+    async def body() -> AsyncIterator[bytes]:
+        chunks: List[bytes] = []
+        async for part in parts:
+            chunk = part.encode()
+            chunks.append(chunk)
+            yield chunk
+        await response_cache.set_if_current(
+            request, b"".join(chunks), [SITEMAP_TAG], headers, ttl=ttl, tag=SITEMAP_TAG, generation=generation
+        )
+
+    return StreamingResponse(body(), media_type="application/xml", headers=headers)
+
+
+async def _from_cache(request: Request) -> Optional[Response]:
+    cached = await response_cache.get(request)
+    if cached is None:
+        return None
+    if is_not_modified(request, cached.headers):
+        return not_modified_response(cached.headers)
+    return Response(content=cached.body, media_type="application/xml", headers=cached.headers)
+
+
 @router.get("/sitemap.xml", response_class=Response)
-async def sitemap_xml(db: AsyncSession = Depends(get_db)):
-    # Fetch products
-    result = await db.execute(select(Product).where(Product.stock > 0))
-    products = result.scalars().all()
-
-    # Static routes
-    static_routes = [
-        {"loc": "https://www.smartindoordecors.com/", "priority": "1.0", "changefreq": "daily"},
-        {"loc": "https://www.smartindoordecors.com/shop", "priority": "0.8", "changefreq": "daily"},
-        {"loc": "https://www.smartindoordecors.com/about", "priority": "0.5", "changefreq": "monthly"},
-        {"loc": "https://www.smartindoordecors.com/blog", "priority": "0.6", "changefreq": "weekly"},
-        {"loc": "https://www.smartindoordecors.com/faq", "priority": "0.6", "changefreq": "monthly"},
-        {"loc": "https://www.smartindoordecors.com/terms", "priority": "0.4", "changefreq": "yearly"},
-        {"loc": "https://www.smartindoordecors.com/privacy", "priority": "0.4", "changefreq": "yearly"},
-        {"loc": "https://www.smartindoordecors.com/services", "priority": "0.5", "changefreq": "monthly"},
-        {"loc": "https://www.smartindoordecors.com/contact", "priority": "0.5", "changefreq": "monthly"},
-        {"loc": "https://www.smartindoordecors.com/testimonials", "priority": "0.5", "changefreq": "monthly"},
-    ]
+async def sitemap_xml(request: Request, db: AsyncSession = Depends(get_db)):
+    """Every URL in one file, or a sitemap index once there are too many."""
+    cached = await _from_cache(request)
+    if cached is not None:
+        return cached
+    # Read before any product query, so changes made while building are noticed
+    generation = await response_cache.generation(SITEMAP_TAG)
 
-    static_urls = [
-        f"""
-        <url>
-            <loc>{route['loc']}</loc>
-            <lastmod>{datetime.utcnow().date()}</lastmod>
-            <changefreq>{route['changefreq']}</changefreq>
-            <priority>{route['priority']}</priority>
-        </url>
-        """
-        for route in static_routes
-    ]
+    # Crawlers revalidate often: answer 304 from one aggregate row when possible.
+    # lastmod of the static routes is today's date, so the date is part of the validator as well.
+    count, newest = (
+        await db.execute(select(func.count(Product.id), func.max(Product.updated_at)).where(*_in_stock()))
+    ).one()
+    today = _today()
 
-    product_urls = [
-        f"""
-        <url>
-            <loc>https://www.smartindoordecors.com/product/{product.id}</loc>
-            <lastmod>{datetime.utcnow().date()}</lastmod>
-            <changefreq>weekly</changefreq>
-            <priority>0.9</priority>
-        </url>
-        """
-        for product in products
+    if count + len(STATIC_ROUTES) <= SITEMAP_MAX_URLS:
+        headers = validator_headers(count, max(newest or today, today), extra=str(today.date()))
+        if is_not_modified(request, headers):
+            return not_modified_response(headers)
+
+        async def parts():
+            yield XML_HEADER + URLSET_OPEN + _static_urls(today)
+            async for chunk in _stream_product_urls(None):
+                yield chunk
+            yield URLSET_CLOSE
+
+        return await _cached_or_streamed(request, headers, _cache_ttl(today), generation, parts())
+
+    shard = Product.id // PRODUCT_SHARD_SIZE
+    shards = (
+        await db.execute(
+            select(shard, func.max(Product.updated_at)).where(*_in_stock()).group_by(shard).order_by(shard)
+        )
+    ).all()
+    headers = validator_headers(
+        count, max(newest or today, today), ids=[n for n, _ in shards], extra=f"index|{today.date()}"
+    )
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+
+    entries = [(request.url_for("static_sitemap_xml"), today)] + [
+        (request.url_for("product_sitemap_xml", shard=n), lastmod) for n, lastmod in shards
     ]
+    content = (
+        XML_HEADER
+        + '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        + "".join(
+            f"<sitemap><loc>{loc}</loc>"
+            + (f"<lastmod>{lastmod.date().isoformat()}</lastmod>" if lastmod else "")
+            + "</sitemap>\n"
+            for loc, lastmod in entries
+        )
+        + "</sitemapindex>\n"
+    )
+    await response_cache.set_if_current(
+        request, content.encode(), [SITEMAP_TAG], headers, ttl=_cache_ttl(today),
+        tag=SITEMAP_TAG, generation=generation,
+    )
+    return Response(content=content, media_type="application/xml", headers=headers)
+
+
+@router.get("/sitemaps/static.xml", response_class=Response)
+async def static_sitemap_xml(request: Request):
+    today = _today()
+    headers = validator_headers(len(STATIC_ROUTES), today, extra=f"static|{today.date()}")
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    content = XML_HEADER + URLSET_OPEN + _static_urls(today) + URLSET_CLOSE
+    return Response(content=content, media_type="application/xml", headers=headers)
+
+
+@router.get("/sitemaps/products-{shard}.xml", response_class=Response)
+async def product_sitemap_xml(shard: int, request: Request, db: AsyncSession = Depends(get_db)):
+    if shard < 0:
+        raise HTTPException(status_code=404, detail="Sitemap not found")
+    cached = await _from_cache(request)
+    if cached is not None:
+        return cached
+    generation = await response_cache.generation(SITEMAP_TAG)
+
+    count, newest = (
+        await db.execute(select(func.count(Product.id), func.max(Product.updated_at)).where(*_in_stock(shard)))
+    ).one()
+    if not count:
+        raise HTTPException(status_code=404, detail="Sitemap not found")
+    headers = validator_headers(count, newest, extra=f"products-{shard}")
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
 
-    content = f"""<?xml version="1.0" encoding="UTF-8"?>
-<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
-{''.join(static_urls)}
-{''.join(product_urls)}
-</urlset>
-"""
+    async def parts():
+        yield XML_HEADER + URLSET_OPEN
+        async for chunk in _stream_product_urls(shard):
+            yield chunk
+        yield URLSET_CLOSE
 
-    return Response(content=content, media_type="application/xml")
+    return await _cached_or_streamed(request, headers, SITEMAP_CACHE_TTL, generation, parts())
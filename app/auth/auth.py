@@ -1,17 +1,24 @@
 
 
 
+import os
+import time
 from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
+from sqlalchemy import case, inspect, literal
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from app.schemas.schema import UserCreate, UserResponse, Token
-from app.database.connection import AsyncSessionLocal
+from sqlalchemy.orm import make_transient_to_detached
+from app.schemas.schema import UserCreate, UserResponse, Token, Principal
+from app.database.connection import AsyncSessionLocal, dialect_insert
 from app.models.models import User
+from app.EMail.email_templates import render_otp_email
+from app.EMail.outbox import email_worker, enqueue_email
+from app.utils.hashing import password_hasher
 from app.utils.utils import (
-    ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token, generate_otp, 
-    get_password_hash, send_otp_email, verify_password,
+    ACCESS_TOKEN_EXPIRE_MINUTES, OTP_EMAIL_SUBJECT, create_access_token, generate_otp,
     SECRET_KEY, ALGORITHM  # Make sure you have these defined in utils.py
 )
 from jose import JWTError, jwt  # pip install python-jose
@@ -34,56 +41,131 @@ def decode_access_token(token: str):
     except JWTError:
         return None
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _token_claims(token: str) -> dict:
     payload = decode_access_token(token)
-    if payload is None:
-        raise credentials_exception
+    if payload is None or payload.get("id") is None:
+        raise _credentials_exception()
+    return payload
+
+
+# --- Short-lived in-process user cache ---
+# Holds a column snapshot per user id so routes that need the full row can
+# skip the users lookup. Each worker has its own copy, so keep the TTL short
+# and call invalidate_cached_user() whenever a user row changes.
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 30))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000))
+
+_user_cache: Dict[int, Tuple[float, dict]] = {}
+_user_columns = [attr.key for attr in inspect(User).column_attrs]
+
+def _cache_user(user: User) -> None:
+    if USER_CACHE_TTL_SECONDS <= 0:
+        return
+    if len(_user_cache) >= USER_CACHE_MAX_ENTRIES:
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _) in _user_cache.items() if expires_at < now]:
+            del _user_cache[key]
+        if len(_user_cache) >= USER_CACHE_MAX_ENTRIES:
+            del _user_cache[next(iter(_user_cache))]
+    snapshot = {key: getattr(user, key) for key in _user_columns}
+    _user_cache[user.id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, snapshot)
+
+def _cached_user(user_id: int) -> Optional[User]:
+    entry = _user_cache.get(user_id)
+    if entry is None:
+        return None
+    expires_at, snapshot = entry
+    if expires_at < time.monotonic():
+        _user_cache.pop(user_id, None)
+        return None
+    # Fresh instance per request, marked as an already-persisted row so it
+    # can be attached to the request session without a SELECT.
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return user
+
+def invalidate_cached_user(user_id: int) -> None:
+    _user_cache.pop(user_id, None)
+
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """Stateless auth: trusts the signed claims and never touches the database.
+
+    Role changes only take effect once the caller's token expires, so use it
+    for routes that act on the caller's own data (cart, own orders). Admin
+    and other role checks go through ``get_current_user``, which a demotion
+    or deletion revokes via ``invalidate_cached_user``.
+    """
+    payload = _token_claims(token)
+    return Principal(
+        id=payload["id"],
+        email=payload.get("sub"),
+        name=payload.get("fullname"),
+        role=payload.get("role") or "Customer",
+    )
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    user_id: int = _token_claims(token)["id"]
 
-    user_id: int = payload.get("id")
-    if user_id is None:
-        raise credentials_exception
+    user = _cached_user(user_id)
+    if user is not None:
+        db.add(user)
+        return user
 
     result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalars().first()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    _cache_user(user)
     return user
 
 # Your existing functions below (register_user, login_for_access_token, etc.) remain unchanged
 async def register_user(user: UserCreate, db: AsyncSession):
-    result = await db.execute(select(User).filter(User.email == user.email))
-    existing_user = result.scalars().first()
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-
-    result = await db.execute(select(User))
-    total_users = result.scalars().all()
-    is_first_user = len(total_users) == 0
-
-    hashed_password = get_password_hash(user.password)
-
-    db_user = User(
-        name=user.name,
-        email=user.email,
-        password_hash=hashed_password,
-        address=user.address,
-        phone=user.phone,
-        role="Admin" if is_first_user else "Customer"
+    hashed_password = await password_hasher.hash(user.password)
+
+    # One round trip: the email uniqueness check is the unique index on
+    # users.email (ON CONFLICT DO NOTHING returns no row), and the very first
+    # account becomes the admin via an EXISTS probe instead of counting users.
+    role = case(
+        (select(User.id).exists(), literal("Customer")),
+        else_=literal("Admin"),
+    )
+    stmt = (
+        dialect_insert(db)(User)
+        .values(
+            name=user.name,
+            email=user.email,
+            password_hash=hashed_password,
+            address=user.address,
+            phone=user.phone,
+            role=role,
+        )
+        .on_conflict_do_nothing(index_elements=[User.email])
+        .returning(User)
     )
-    db.add(db_user)
+    db_user = (await db.execute(stmt)).scalar_one_or_none()
+    if db_user is None:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    user_out = UserResponse.model_validate(db_user, from_attributes=True)
     await db.commit()
-    await db.refresh(db_user)
-    return db_user
+    return user_out
 
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm, db: AsyncSession):
     result = await db.execute(select(User).filter(User.email == form_data.username))
     user = result.scalars().first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await password_hasher.verify_and_update(
+            form_data.password, user.password_hash
+        )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -98,6 +180,14 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm, db: Async
               "role": user.role
               }, expires_delta=access_token_expires
     )
+
+    # Stored hash uses an outdated bcrypt cost: upgrade it now that we have the password
+    if new_hash:
+        user.password_hash = new_hash
+        user_id = user.id
+        await db.commit()
+        invalidate_cached_user(user_id)
+
     return {"access_token": access_token, "token_type": "bearer"}
 
 async def request_password_reset(email: str, db: AsyncSession):
@@ -109,9 +199,13 @@ async def request_password_reset(email: str, db: AsyncSession):
     otp = generate_otp()
     user.otp = otp
     user.otp_expires_at = datetime.utcnow() + timedelta(minutes=10)
+    user_id = user.id
+    # Delivered by the outbox worker; committed together with the OTP
+    body_html, body_text = render_otp_email(otp)
+    enqueue_email(db, OTP_EMAIL_SUBJECT, email, body_html, body_text)
     await db.commit()
-
-    send_otp_email(email, otp)
+    invalidate_cached_user(user_id)
+    email_worker.wake()
 
 async def reset_password(email: str, otp: str, new_password: str, db: AsyncSession):
     result = await db.execute(select(User).where(User.email == email))
@@ -122,7 +216,9 @@ async def reset_password(email: str, otp: str, new_password: str, db: AsyncSessi
     if user.otp != otp or user.otp_expires_at < datetime.utcnow():
         raise HTTPException(status_code=400, detail="Invalid or expired OTP")
 
-    user.password_hash = get_password_hash(new_password)
+    user.password_hash = await password_hasher.hash(new_password)
     user.otp = None
     user.otp_expires_at = None
+    user_id = user.id
     await db.commit()
+    invalidate_cached_user(user_id)
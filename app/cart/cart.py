@@ -0,0 +1,207 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, join, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.database.connection import dialect_insert
+from app.models.models import Cart, CartItem, Product
+from app.schemas.schema import CartCompactOut, CartLineOut, CartSummaryOut
+from app.search.suggest import thumbnail_column
+
+
+async def get_or_create_cart_id(db: AsyncSession, user_id: int) -> int:
+    """Return the user's cart id, creating the cart if needed, in one statement.
+
+    ``ON CONFLICT (user_id) DO UPDATE`` (rather than DO NOTHING) makes the
+    existing row come back from RETURNING, and bumps ``updated_at`` as the
+    cart's last activity. Does not commit.
+    """
+    now = datetime.utcnow()
+    insert = dialect_insert(db)(Cart).values(user_id=user_id, created_at=now, updated_at=now)
+    return await db.scalar(
+        insert.on_conflict_do_update(
+            index_elements=[Cart.user_id], set_={"updated_at": insert.excluded.updated_at}
+        ).returning(Cart.id)
+    )
+
+
+async def touch_cart(db: AsyncSession, user_id: int) -> Optional[int]:
+    """Bump the user's cart activity time; returns its id, or None if there is no cart."""
+    return await db.scalar(
+        update(Cart)
+        .where(Cart.user_id == user_id)
+        .values(updated_at=datetime.utcnow())
+        .returning(Cart.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _upsert_lines(db: AsyncSession, cart_id: int, quantities: Dict[int, int], increment: bool):
+    now = datetime.utcnow()
+    insert = dialect_insert(db)(CartItem).values([
+        dict(cart_id=cart_id, product_id=product_id, quantity=quantity, created_at=now, updated_at=now)
+        for product_id, quantity in quantities.items()
+    ])
+    new_quantity = CartItem.quantity + insert.excluded.quantity if increment else insert.excluded.quantity
+    return insert.on_conflict_do_update(
+        index_elements=[CartItem.cart_id, CartItem.product_id],
+        set_={"quantity": new_quantity, "updated_at": insert.excluded.updated_at},
+    )
+
+
+async def add_cart_item(db: AsyncSession, cart_id: int, product_id: int, quantity: int) -> int:
+    """Add ``quantity`` of a product to a cart with a single upsert; returns the new line quantity.
+
+    Concurrent adds of the same product serialise on the unique
+    (cart_id, product_id) row instead of inserting duplicates. Does not commit.
+    """
+    stmt = _upsert_lines(db, cart_id, {product_id: quantity}, increment=True)
+    return await db.scalar(stmt.returning(CartItem.quantity))
+
+
+async def upsert_cart_items(db: AsyncSession, cart_id: int, quantities: Dict[int, int], increment: bool) -> None:
+    """Add to (``increment``) or overwrite many lines with one multi-row upsert. Does not commit."""
+    if quantities:
+        await db.execute(_upsert_lines(db, cart_id, quantities, increment))
+
+
+async def set_cart_item_quantity(db: AsyncSession, cart_id: int, product_id: int, quantity: int) -> bool:
+    """Set an existing line's quantity; False if the product is not in the cart. Does not commit."""
+    result = await db.execute(
+        update(CartItem)
+        .where(CartItem.cart_id == cart_id, CartItem.product_id == product_id)
+        .values(quantity=quantity, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+async def remove_cart_item(db: AsyncSession, cart_id: int, product_id: int) -> bool:
+    """Delete a line; False if the product was not in the cart. Does not commit."""
+    return await remove_cart_items(db, cart_id, [product_id]) > 0
+
+
+async def remove_cart_items(db: AsyncSession, cart_id: int, product_ids: Iterable[int]) -> int:
+    """Delete many lines in one statement; returns how many existed. Does not commit."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    result = await db.execute(
+        delete(CartItem)
+        .where(CartItem.cart_id == cart_id, CartItem.product_id.in_(product_ids))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def fold_operations(operations: Iterable) -> Tuple[Dict[int, int], Dict[int, int], List[int]]:
+    """Reduce ordered add/set/remove operations to one effect per product.
+
+    Returns ``(increments, absolute, removed)``: quantities to add to the
+    current line, quantities to set outright, and products to drop. E.g.
+    ``set 2`` then ``add 1`` is ``set 3``; ``remove`` then ``add 1`` is ``set 1``.
+    """
+    effects: Dict[int, Tuple[str, int]] = {}
+    for op in operations:
+        kind, current = effects.get(op.product_id, (None, 0))
+        if op.op == "remove" or (op.op == "set" and op.quantity == 0):
+            effects[op.product_id] = ("remove", 0)
+        elif op.op == "set":
+            effects[op.product_id] = ("set", op.quantity)
+        elif kind == "remove":
+            effects[op.product_id] = ("set", op.quantity)
+        else:
+            effects[op.product_id] = (kind or "add", current + op.quantity)
+
+    increments = {pid: q for pid, (kind, q) in effects.items() if kind == "add"}
+    absolute = {pid: q for pid, (kind, q) in effects.items() if kind == "set"}
+    removed = [pid for pid, (kind, _) in effects.items() if kind == "remove"]
+    return increments, absolute, removed
+
+
+async def load_cart(db: AsyncSession, user_id: int) -> Optional[Cart]:
+    """The user's cart with every line's product (category, images, videos) eagerly loaded."""
+    result = await db.execute(
+        select(Cart)
+        .options(
+            selectinload(Cart.cart_items)
+                .selectinload(CartItem.product)
+                .selectinload(Product.category),
+            selectinload(Cart.cart_items)
+                .selectinload(CartItem.product)
+                .selectinload(Product.images),
+            selectinload(Cart.cart_items)
+                .selectinload(CartItem.product)
+                .selectinload(Product.videos),
+        )
+        .where(Cart.user_id == user_id)
+    )
+    return result.scalar_one_or_none()
+
+
+
+def _priced_lines():
+    # Lines whose product is gone or has no price cannot be bought: both cart
+    # views leave them out, so the compact totals match the summary's.
+    return and_(Product.id == CartItem.product_id, Product.price.isnot(None))
+
+
+async def load_cart_lines(db: AsyncSession, user_id: int) -> Optional[CartCompactOut]:
+    """The user's cart as flat lines with computed totals, from one joined column query."""
+    # The cart is outer-joined to (items JOIN products), so an empty cart still yields its row
+    lines = join(CartItem, Product, _priced_lines())
+    rows = (
+        await db.execute(
+            select(
+                Cart.id, Cart.user_id, Cart.updated_at,
+                CartItem.product_id, Product.name, thumbnail_column(), Product.price, CartItem.quantity,
+            )
+            .select_from(Cart)
+            .outerjoin(lines, CartItem.cart_id == Cart.id)
+            .where(Cart.user_id == user_id)
+            .order_by(CartItem.id)
+        )
+    ).all()
+    if not rows:
+        return None
+
+    cart_id, cart_user_id, updated_at = rows[0][:3]
+    items = [
+        CartLineOut(
+            product_id=product_id,
+            name=name,
+            thumbnail=thumbnail,
+            unit_price=price,
+            quantity=quantity or 0,
+            line_total=round(price * (quantity or 0), 2),
+        )
+        for _, _, _, product_id, name, thumbnail, price, quantity in rows
+        if product_id is not None  # the outer join's row for a cart without (priced) lines
+    ]
+    return CartCompactOut(
+        id=cart_id,
+        user_id=cart_user_id,
+        updated_at=updated_at,
+        items=items,
+        item_count=sum(line.quantity for line in items),
+        subtotal=round(sum(line.line_total for line in items), 2),
+    )
+
+
+async def cart_summary(db: AsyncSession, user_id: int) -> CartSummaryOut:
+    """Item count and subtotal from one aggregate query; zeros when the user has no cart."""
+    item_count, subtotal = (
+        await db.execute(
+            select(
+                func.coalesce(func.sum(CartItem.quantity), 0),
+                func.coalesce(func.sum(CartItem.quantity * Product.price), 0),
+            )
+            .select_from(Cart)
+            .join(CartItem, CartItem.cart_id == Cart.id)
+            .join(Product, _priced_lines())
+            .where(Cart.user_id == user_id)
+        )
+    ).one()
+    return CartSummaryOut(item_count=item_count, subtotal=round(subtotal, 2))
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.connection import AsyncSessionLocal
+from app.models.models import AbandonedCart, Cart, CartItem, Product
+
+log = logging.getLogger(__name__)
+
+CART_SWEEP_ENABLED = os.getenv("CART_SWEEP_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+# A cart untouched for this long is abandoned
+CART_TTL_DAYS = float(os.getenv("CART_TTL_DAYS", 30))
+CART_SWEEP_INTERVAL_SECONDS = float(os.getenv("CART_SWEEP_INTERVAL_SECONDS", 3600))
+# Small transactions with a pause in between keep row locks short and WAL/replication lag flat
+CART_SWEEP_BATCH_SIZE = int(os.getenv("CART_SWEEP_BATCH_SIZE", 500))
+CART_SWEEP_PAUSE_SECONDS = float(os.getenv("CART_SWEEP_PAUSE_SECONDS", 0.5))
+CART_SWEEP_MAX_BATCHES = int(os.getenv("CART_SWEEP_MAX_BATCHES", 200))
+
+
+async def sweep_batch(db: AsyncSession, cutoff: datetime, limit: int) -> Tuple[int, int]:
+    """Expire up to ``limit`` carts idle since before ``cutoff``. Commits.
+
+    Returns ``(expired, recorded)``: carts deleted, and how many of them had
+    lines and were copied into ``abandoned_carts``.
+
+    Candidates are locked with FOR UPDATE SKIP LOCKED (in ``updated_at``
+    index order), so a cart being written to right now is skipped rather
+    than waited on, and it cannot be touched between the snapshot and the
+    delete. Non-empty carts are first copied into ``abandoned_carts`` with
+    a single INSERT ... SELECT.
+    """
+    cart_ids = (
+        await db.execute(
+            select(Cart.id)
+            .where(Cart.updated_at < cutoff)
+            .order_by(Cart.updated_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+    ).scalars().all()
+    if not cart_ids:
+        await db.rollback()
+        return 0, 0
+
+    now = datetime.utcnow()
+    snapshot = (
+        select(
+            Cart.id,
+            Cart.user_id,
+            func.count(CartItem.id),
+            func.coalesce(func.sum(CartItem.quantity), 0),
+            func.coalesce(func.sum(CartItem.quantity * Product.price), 0.0),
+            Cart.updated_at,
+            literal(now),
+        )
+        .join(CartItem, CartItem.cart_id == Cart.id)
+        .join(Product, Product.id == CartItem.product_id)
+        .where(Cart.id.in_(cart_ids))
+        .group_by(Cart.id, Cart.user_id, Cart.updated_at)
+    )
+    recorded = await db.execute(
+        insert(AbandonedCart).from_select(
+            ["cart_id", "user_id", "line_count", "unit_count", "subtotal", "last_activity_at", "swept_at"],
+            snapshot,
+        )
+    )
+    await db.execute(
+        delete(CartItem).where(CartItem.cart_id.in_(cart_ids)).execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(Cart).where(Cart.id.in_(cart_ids)).execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return len(cart_ids), recorded.rowcount
+
+
+class AbandonedCartSweeper:
+    """Background task that expires carts idle longer than the TTL.
+
+    Each run deletes in batches of ``batch_size`` carts, one transaction per
+    batch with ``pause_seconds`` in between, and stops after ``max_batches``
+    so a large backlog is worked off over several runs rather than in one
+    burst on the primary.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        ttl: timedelta = timedelta(days=CART_TTL_DAYS),
+        interval_seconds: float = CART_SWEEP_INTERVAL_SECONDS,
+        batch_size: int = CART_SWEEP_BATCH_SIZE,
+        pause_seconds: float = CART_SWEEP_PAUSE_SECONDS,
+        max_batches: int = CART_SWEEP_MAX_BATCHES,
+    ):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.max_batches = max_batches
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.expired = 0
+        self.recorded = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_run_expired = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="cart-sweeper")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Abandoned-cart sweep failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self) -> int:
+        """Sweep until nothing is left or ``max_batches`` ran; returns carts expired."""
+        cutoff = datetime.utcnow() - self.ttl
+        total = 0
+        for batch in range(self.max_batches):
+            if batch:
+                await asyncio.sleep(self.pause_seconds)
+            async with self.session_factory() as db:
+                swept, recorded = await sweep_batch(db, cutoff, self.batch_size)
+            total += swept
+            self.expired += swept
+            self.recorded += recorded
+            if swept < self.batch_size:
+                break
+        self.runs += 1
+        self.last_run_at = datetime.utcnow()
+        self.last_run_expired = total
+        if total:
+            log.info("Expired %s abandoned carts idle since before %s", total, cutoff)
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "ttl_days": self.ttl.total_seconds() / 86400,
+            "runs": self.runs,
+            "expired": self.expired,
+            "recorded": self.recorded,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_run_expired": self.last_run_expired,
+        }
+
+
+cart_sweeper = AbandonedCartSweeper()
@@ -42,10 +42,17 @@
 
 import ssl
 import os
+import time
 from dotenv import load_dotenv
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.utils.metrics import DB_POOL_WAIT
 
 # Load environment variables
 load_dotenv()
@@ -54,17 +61,140 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 assert DATABASE_URL is not None, "❌ DATABASE_URL not loaded from .env"
 
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+# --- Engine / pool settings ---
+# Each uvicorn worker owns its own pool, so the database sees up to
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+DB_ECHO = _env_flag("DB_ECHO", False)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = _env_flag("DB_POOL_PRE_PING", True)
+DB_SSL = _env_flag("DB_SSL", True)
+# asyncpg prepared-statement cache; set to 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+# Server-side statement_timeout in milliseconds (0 keeps the server default)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+
 # --- SSL Context (optional for cloud DBs like Supabase or PlanetScale) ---
 ssl_context = ssl.create_default_context()
 ssl_context.check_hostname = False
 ssl_context.verify_mode = ssl.CERT_NONE
 
+
+# --- Pool metrics ---
+class PoolMetrics:
+    """Counters for connection checkouts and the time spent waiting on the pool.
+
+    ``checkout_errors`` counts checkouts that failed (pool timeout or a
+    connect error), so compare it with ``waits`` when sizing the pool.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.checkout_errors = 0
+
+    def record_wait(self, seconds: float, failed: bool = False) -> None:
+        DB_POOL_WAIT.observe(seconds)
+        self.waits += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+        if failed:
+            self.checkout_errors += 1
+
+    def attach(self, engine: AsyncEngine) -> None:
+        sync_engine = engine.sync_engine
+
+        @event.listens_for(sync_engine, "checkout")
+        def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+            self.checkouts += 1
+
+        @event.listens_for(sync_engine, "connect")
+        def _on_connect(dbapi_conn, conn_record):
+            self.connects += 1
+
+        @event.listens_for(sync_engine, "invalidate")
+        def _on_invalidate(dbapi_conn, conn_record, exception):
+            self.invalidations += 1
+
+    def snapshot(self, engine: AsyncEngine) -> dict:
+        pool = engine.sync_engine.pool
+        stats = {
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+            "waits": self.waits,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+            "checkout_errors": self.checkout_errors,
+        }
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            stats.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                max_overflow=pool._max_overflow,
+            )
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        failed = False
+        try:
+            return super()._do_get()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start, failed)
+
+
+def create_engine_from_settings(url: str = DATABASE_URL) -> AsyncEngine:
+    db_url = make_url(url)
+    engine_kwargs = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+    connect_args = {}
+
+    if db_url.get_backend_name() != "sqlite":
+        engine_kwargs.update(
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+
+    if db_url.get_driver_name() == "asyncpg":
+        connect_args["statement_cache_size"] = DB_STATEMENT_CACHE_SIZE
+        if DB_STATEMENT_TIMEOUT_MS > 0:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        if DB_SSL:
+            connect_args["ssl"] = ssl_context
+
+    new_engine = create_async_engine(url, connect_args=connect_args, **engine_kwargs)
+    pool_metrics.attach(new_engine)
+    return new_engine
+
+
 # --- Async Engine ---
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,  # Set to False in production
-    connect_args={"ssl": ssl_context}
-)
+engine = create_engine_from_settings()
 
 # --- SessionMaker ---
 AsyncSessionLocal = sessionmaker(
@@ -86,4 +216,15 @@ async def get_db():
             await session.close()
 
 
-# from app.models.models import User,Category,Product,Order,OrderItem,Cart,ProductImage,ProductVideo
\ No newline at end of file
+def get_pool_stats() -> dict:
+    return pool_metrics.snapshot(engine)
+
+
+def dialect_insert(db: AsyncSession):
+    """``insert`` of the session's dialect, which supports ON CONFLICT (Postgres, or SQLite locally)."""
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert
+    return postgresql.insert
+
+
+# from app.models.models import User,Category,Product,Order,OrderItem,Cart,ProductImage,ProductVideo
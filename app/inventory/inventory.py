@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import Order, OrderItem, Product
+
+# Order status that means the order no longer holds any stock.
+CANCELLED_STATUS = "cancelled"
+# The only status in which an order holds reserved stock that can go back on
+# the shelf; once paid or fulfilled the goods are sold, whatever happens next.
+PENDING_STATUS = "pending"
+
+
+def aggregate_quantities(items: Iterable) -> Dict[int, int]:
+    """Sum requested quantities per product id (an order may repeat a product)."""
+    quantities: Dict[int, int] = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+
+async def reserve_stock(db: AsyncSession, quantities: Dict[int, int]) -> Dict[int, int]:
+    """Take stock for a whole order with a single conditional UPDATE.
+
+    Every row is decremented only if ``stock >= quantity`` still holds when the
+    row lock is taken, so concurrent orders can never drive stock negative.
+    If any product is short the transaction is rolled back and a 409 is
+    raised; otherwise the new stock level per product is returned.
+    """
+    wanted = case(quantities, value=Product.id)
+
+    result = await db.execute(
+        update(Product)
+        .where(Product.id.in_(quantities))
+        .where(Product.stock >= wanted)
+        .values(stock=Product.stock - wanted)
+        .returning(Product.id, Product.stock)
+        .execution_options(synchronize_session=False)
+    )
+    reserved = dict(result.all())
+
+    if len(reserved) != len(quantities):
+        short = sorted(set(quantities) - reserved.keys())
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Insufficient stock for products: {short}",
+        )
+    return reserved
+
+
+async def cancel_order(db: AsyncSession, order_id: int) -> Optional[List[int]]:
+    """Cancel a pending order and hand its reserved stock back.
+
+    The status flip is conditional on the order still being pending, so when
+    a manual cancel and a failed payment race each other the stock is only
+    released once, and a paid or fulfilled order is never restocked. Returns
+    the ids of the restocked products, or None if the order was not pending
+    (or does not exist) and nothing changed. Does not commit.
+    """
+    result = await db.execute(
+        update(Order)
+        .where(Order.id == order_id)
+        .where(func.lower(Order.status) == PENDING_STATUS)
+        .values(status=CANCELLED_STATUS, updated_at=datetime.utcnow())
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.scalar_one_or_none() is None:
+        return None
+
+    held = (
+        select(OrderItem.product_id, func.sum(OrderItem.quantity).label("quantity"))
+        .where(OrderItem.order_id == order_id)
+        .group_by(OrderItem.product_id)
+        .subquery()
+    )
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == held.c.product_id)
+        .values(stock=Product.stock + held.c.quantity)
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars().all())
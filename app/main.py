@@ -1,10 +1,58 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import func, select
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from app.api.public import sitemap
 from app.routers import users ,categories,products,order,cart,cart_items,mpesa_router
+from app.routers.mpesa_auth import close_daraja_client, get_daraja_client
+from app.database.connection import AsyncSessionLocal, engine, get_pool_stats
+from app.middleware.query_counter import QUERY_COUNTER_ENABLED, QueryCounterMiddleware, attach_query_counter
+from app.middleware.metrics import HttpMetricsMiddleware
+from app.models.models import EmailOutbox
+from app.search.search import search_backend
+from app.search.suggest import suggest_index
+from app.utils.hashing import password_hasher
+from app.EMail.email_templates import product_cards
+from app.EMail.outbox import EMAIL_OUTBOX_ENABLED, PENDING as EMAIL_PENDING, SENDING as EMAIL_SENDING, email_worker
+from app.payments.callback_queue import callback_processor
+from app.payments.reconciler import MPESA_RECONCILE_ENABLED, payment_reconciler
+from app.cart.sweeper import CART_SWEEP_ENABLED, cart_sweeper
+from app.utils.cache import response_cache
+from app.utils.metrics import metrics
+from app.utils.pagination import NEXT_CURSOR_HEADER
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared M-Pesa client: pooled connections + cached OAuth token
+    app.state.daraja = get_daraja_client()
+    # Search indexes: the full-text one is a no-op on Postgres
+    async with AsyncSessionLocal() as db:
+        await search_backend.rebuild(db)
+        await suggest_index.rebuild(db)
+    # Delivers queued emails (and anything left over from before a restart)
+    if EMAIL_OUTBOX_ENABLED:
+        email_worker.start()
+    # Applies logged M-Pesa callbacks, starting with any left over from before a restart
+    callback_processor.start()
+    # Settles PENDING payments whose callback never arrived
+    if MPESA_RECONCILE_ENABLED:
+        payment_reconciler.start()
+    # Expires carts idle past CART_TTL_DAYS, in small throttled batches
+    if CART_SWEEP_ENABLED:
+        cart_sweeper.start()
+    yield
+    await cart_sweeper.stop()
+    await payment_reconciler.stop()
+    await callback_processor.stop()
+    await email_worker.stop()
+    await close_daraja_client()
+    password_hasher.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -13,11 +61,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Last-Modified"],
 )
 
 # Add session middleware
 app.add_middleware(SessionMiddleware, secret_key="super-secret-session-key-please-change")
 
+# Per-request query count / DB time (Server-Timing header) and N+1 warnings
+if QUERY_COUNTER_ENABLED:
+    attach_query_counter(engine)
+    app.add_middleware(QueryCounterMiddleware)
+
+# Outermost, so latency covers every other middleware too
+app.add_middleware(HttpMetricsMiddleware)
+
+
+# Declared before the routers: categories' "/{category_id}" would shadow it
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus text exposition for this worker (see the collectors below)."""
+    return PlainTextResponse(await metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 app.include_router(sitemap.router, tags=["SiteMaps"])
 
@@ -34,3 +98,111 @@ app.include_router(mpesa_router.router,prefix="/mpesa", tags=["M-PESA"])
 @app.get("/")
 def root():
     return {"message": "Ecommerce API is running"}
+
+
+@app.get("/health/db", tags=["Health"])
+def db_pool_stats():
+    """Connection pool usage for this worker (checkouts, waits, overflow)."""
+    return get_pool_stats()
+
+
+@app.get("/health/hashing", tags=["Health"])
+def password_hashing_stats():
+    """bcrypt pool usage for this worker (queue depth, rejections, rehashes)."""
+    return password_hasher.stats()
+
+
+@app.get("/health/email", tags=["Health"])
+def email_outbox_stats():
+    """Outbox delivery counters for this worker."""
+    return email_worker.stats()
+
+
+@app.get("/health/payments", tags=["Health"])
+def payment_callback_stats():
+    """M-Pesa callback queue depth, lag and outcomes for this worker."""
+    return callback_processor.stats()
+
+
+@app.get("/health/reconciler", tags=["Health"])
+def payment_reconciler_stats():
+    """STK Query reconciliation counters for this worker."""
+    return payment_reconciler.stats()
+
+
+@app.get("/health/carts", tags=["Health"])
+def cart_sweeper_stats():
+    """Abandoned-cart sweep counters for this worker."""
+    return cart_sweeper.stats()
+
+
+# --- Prometheus metrics (per worker) ---
+def _samples(stats: dict, *keys: str):
+    return [({}, stats[key]) for key in keys]
+
+
+@metrics.collector
+def _runtime_stats():
+    """Export the counters the health endpoints already keep."""
+    pool = get_pool_stats()
+    hashing = password_hasher.stats()
+    email = email_worker.stats()
+    callbacks = callback_processor.stats()
+    reconciler = payment_reconciler.stats()
+    families = [
+        ("db_pool_checkouts_total", "counter", "Pooled connection checkouts.", _samples(pool, "checkouts")),
+        ("db_pool_checkout_errors_total", "counter", "Checkouts that timed out or failed to connect.",
+         _samples(pool, "checkout_errors")),
+        ("password_hash_pending", "gauge", "bcrypt jobs running or queued.", _samples(hashing, "pending")),
+        ("password_hash_rejected_total", "counter", "Sign-ins rejected with 503 because the bcrypt pool was full.",
+         _samples(hashing, "rejected")),
+        ("email_sent_total", "counter", "Emails delivered by the outbox worker.", _samples(email, "sent")),
+        ("email_retried_total", "counter", "Email deliveries scheduled for retry.", _samples(email, "retried")),
+        ("email_failed_total", "counter", "Emails given up on.", _samples(email, "failed")),
+        ("mpesa_callback_queue_depth", "gauge", "Logged callbacks waiting for a consumer.",
+         _samples(callbacks, "queue_depth")),
+        ("mpesa_callback_deferred_total", "counter", "Callbacks left for the sweep because the queue was full.",
+         _samples(callbacks, "deferred")),
+        ("mpesa_callback_errors_total", "counter", "Callbacks whose processing raised.", _samples(callbacks, "errors")),
+        ("mpesa_callback_max_lag_seconds", "gauge", "Longest wait between logging and processing a callback.",
+         _samples(callbacks, "max_lag_seconds")),
+        ("mpesa_reconciled_total", "counter", "Stale payments settled from an STK query.", [
+            ({"status": "COMPLETED"}, reconciler["settled_completed"]),
+            ({"status": "FAILED"}, reconciler["settled_failed"]),
+        ]),
+        ("mpesa_reconcile_errors_total", "counter", "STK queries or settlements that failed.",
+         _samples(reconciler, "errors")),
+        ("carts_expired_total", "counter", "Abandoned carts deleted by the sweeper.",
+         [({}, cart_sweeper.expired)]),
+        ("carts_abandoned_recorded_total", "counter", "Expired non-empty carts recorded in abandoned_carts.",
+         [({}, cart_sweeper.recorded)]),
+        ("cache_requests_total", "counter", "Cache lookups by cache and result.", [
+            ({"cache": "response", "result": "hit"}, response_cache.hits),
+            ({"cache": "response", "result": "miss"}, response_cache.misses),
+            ({"cache": "email_fragment", "result": "hit"}, product_cards.hits),
+            ({"cache": "email_fragment", "result": "miss"}, product_cards.misses),
+        ]),
+    ]
+    if "size" in pool:
+        families.append(("db_pool_connections", "gauge", "Pool connections by state.", [
+            ({"state": "checked_out"}, pool["checked_out"]),
+            ({"state": "checked_in"}, pool["checked_in"]),
+            ({"state": "overflow"}, max(pool["overflow"], 0)),
+        ]))
+    return families
+
+
+@metrics.collector
+async def _email_outbox_depth():
+    async with AsyncSessionLocal() as db:
+        rows = (
+            await db.execute(
+                select(EmailOutbox.status, func.count())
+                .where(EmailOutbox.status.in_([EMAIL_PENDING, EMAIL_SENDING]))
+                .group_by(EmailOutbox.status)
+            )
+        ).all()
+    counts = dict(rows)
+    return [("email_outbox_depth", "gauge", "Emails waiting in the outbox by status.", [
+        ({"status": status}, counts.get(status, 0)) for status in (EMAIL_PENDING, EMAIL_SENDING)
+    ])]
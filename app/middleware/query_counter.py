@@ -0,0 +1,160 @@
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+log = logging.getLogger(__name__)
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+QUERY_COUNTER_ENABLED = _env_flag("QUERY_COUNTER_ENABLED", True)
+# The same statement shape this many times in one request is reported as a likely N+1
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", 5))
+# Queries allowed per request (0 = no budget). Over budget is logged, or fails in strict mode.
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", 0))
+# For test runs: raise QueryBudgetExceeded at the first query over the budget
+QUERY_BUDGET_STRICT = _env_flag("QUERY_BUDGET_STRICT", False)
+
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|\$\d+|%s|%\(\w+\)s)\s*,)+\s*(?:\?|\$\d+|%s|%\(\w+\)s)\s*\)")
+_PLACEHOLDER = re.compile(r"\$\d+|%\(\w+\)s|%s")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def statement_shape(statement: str) -> str:
+    """Normalise SQL so the same query with other parameters compares equal."""
+    shape = _PLACEHOLDER.sub("?", statement)
+    shape = _IN_LIST.sub("(?, ...)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+class QueryStats:
+    """Queries issued while handling one request."""
+
+    def __init__(self, budget: int = QUERY_BUDGET, strict: bool = QUERY_BUDGET_STRICT):
+        self.budget = budget
+        self.strict = strict
+        self.count = 0
+        self.db_seconds = 0.0
+        self.shapes: Counter = Counter()
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> dict:
+        return {shape: n for shape, n in self.shapes.items() if n >= threshold}
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget > 0 and self.count > self.budget
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+def attach_query_counter(engine: AsyncEngine) -> None:
+    """Count every cursor execution on ``engine`` against the active request, if any."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats.get()
+        if stats is None:
+            return
+        stats.count += 1
+        stats.shapes[statement_shape(statement)] += 1
+        if stats.strict and stats.over_budget:
+            raise QueryBudgetExceeded(
+                f"Query {stats.count} exceeds the budget of {stats.budget}: {statement_shape(statement)[:200]}"
+            )
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats.get()
+        starts = conn.info.get("query_start")
+        if stats is None or not starts:
+            return
+        stats.db_seconds += time.perf_counter() - starts.pop()
+
+
+class QueryCounterMiddleware:
+    """Pure ASGI middleware that reports per-request query statistics.
+
+    Adds a ``Server-Timing: db;dur=<ms>;desc="<n> queries"`` header (queries
+    run after the response has started, e.g. in a streamed body, only show
+    up in the log line) and logs a structured summary, at WARNING when a
+    statement shape repeats ``QUERY_REPEAT_THRESHOLD`` times or the request
+    goes over ``QUERY_BUDGET``.
+    """
+
+    def __init__(self, app, budget: int = QUERY_BUDGET, strict: bool = QUERY_BUDGET_STRICT):
+        self.app = app
+        self.budget = budget
+        self.strict = strict
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(self.budget, self.strict)
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timing = (
+                    f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.count} queries", '
+                    f"app;dur={(time.perf_counter() - started) * 1000:.1f}"
+                )
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_stats.reset(token)
+            self._report(scope, stats, time.perf_counter() - started)
+
+    def _report(self, scope, stats: QueryStats, elapsed: float) -> None:
+        route = scope.get("route")
+        path = getattr(route, "path", None) or scope.get("path")
+        repeated = stats.repeated()
+        summary = {
+            "method": scope.get("method"),
+            "route": path,
+            "queries": stats.count,
+            "db_ms": round(stats.db_seconds * 1000, 1),
+            "total_ms": round(elapsed * 1000, 1),
+            "repeated": repeated,
+        }
+        if repeated:
+            log.warning(
+                "Possible N+1 on %s %s: %s", summary["method"], path,
+                "; ".join(f"{n}x {shape[:200]}" for shape, n in repeated.items()),
+                extra={"query_stats": summary},
+            )
+        if stats.over_budget:
+            log.warning(
+                "%s %s ran %d queries (budget %d)", summary["method"], path, stats.count, stats.budget,
+                extra={"query_stats": summary},
+            )
+        log.debug(
+            "%s %s: %d queries, %.1f ms in db", summary["method"], path, stats.count, summary["db_ms"],
+            extra={"query_stats": summary},
+        )
@@ -4,7 +4,7 @@
 
 
 from sqlalchemy import (
-    Column, Date, DateTime, Integer, String, Text, Float, ForeignKey, Boolean, func
+    Column, Date, DateTime, Integer, String, Text, Float, ForeignKey, Boolean, Index, UniqueConstraint, text
 )
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -160,9 +160,11 @@ class Cart(Base):
     __tablename__ = 'carts'
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+    # One cart per user; the unique index is the ON CONFLICT target for get-or-create
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), unique=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Last cart activity; indexed for the abandoned-cart sweep
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     user = relationship("User", back_populates="cart")
     cart_items = relationship("CartItem", back_populates="cart")
@@ -170,6 +172,10 @@ class Cart(Base):
 
 class CartItem(Base):
     __tablename__ = 'cart_items'
+    __table_args__ = (
+        # A product appears once per cart; adds upsert the quantity
+        UniqueConstraint('cart_id', 'product_id', name='uq_cart_items_cart_id_product_id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     cart_id = Column(Integer, ForeignKey('carts.id', ondelete='CASCADE'))
@@ -189,15 +195,71 @@ class Payment(Base):
     order_id = Column(Integer, ForeignKey('orders.id', ondelete='CASCADE'))
     amount = Column(Float)
     payment_method = Column(String, nullable=False)
-    status = Column(String, nullable=False, default="PENDING")  # PENDING, COMPLETED, CANCELLED, FAILED
+    status = Column(String, nullable=False, default="PENDING")  # PENDING, COMPLETED, CANCELLED, FAILED, UNDERPAID
 
     phone_number = Column(String, nullable=True)
-    mpesa_receipt_number = Column(String, nullable=True)
+    mpesa_receipt_number = Column(String, nullable=True, unique=True, index=True)
     transaction_date = Column(DateTime, nullable=True)
     merchant_request_id = Column(String, nullable=True)
-    checkout_request_id = Column(String, nullable=True)
+    checkout_request_id = Column(String, nullable=True, unique=True, index=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    order = relationship("Order", back_populates="payment")
+
+
+class MpesaCallbackLog(Base):
+    """Every callback body exactly as received, kept for audit and replay."""
+    __tablename__ = 'mpesa_callback_log'
+    __table_args__ = (
+        Index('ix_mpesa_callback_log_unprocessed', 'id', postgresql_where=text('processed_at IS NULL')),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    checkout_request_id = Column(String, nullable=True, index=True)
+    result_code = Column(Integer, nullable=True)
+    payload = Column(Text, nullable=False)  # raw request body
+
+    received_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = Column(DateTime, nullable=True)
+    outcome = Column(String, nullable=True)  # applied, duplicate, unknown_payment, error
+    error = Column(Text, nullable=True)
 
-    created_at = Column(DateTime, default=func.utcnow())
-    updated_at = Column(DateTime, default=func.utcnow(), onupdate=func.utcnow())
 
-    order = relationship("Order", back_populates="payment")
\ No newline at end of file
+class EmailOutbox(Base):
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipients = Column(Text, nullable=False)  # comma separated
+    subject = Column(String, nullable=False)
+    body_html = Column(Text, nullable=False)
+    body_text = Column(Text, nullable=True)  # plain-text alternative (optional)
+
+    status = Column(String, nullable=False, default="PENDING")  # PENDING, SENDING, SENT, FAILED
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)  # lease held by a worker while SENDING
+    sent_at = Column(DateTime, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+
+class AbandonedCart(Base):
+    """Snapshot of a non-empty cart taken when the sweeper expires it (for marketing)."""
+    __tablename__ = 'abandoned_carts'
+
+    id = Column(Integer, primary_key=True, index=True)
+    cart_id = Column(Integer, nullable=False)  # the deleted cart, no FK
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=True, index=True)
+    line_count = Column(Integer, nullable=False)
+    unit_count = Column(Integer, nullable=False)
+    subtotal = Column(Float, nullable=False)  # at current catalogue prices
+    last_activity_at = Column(DateTime, nullable=True)
+    swept_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
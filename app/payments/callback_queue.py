@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Set
+
+from sqlalchemy import select
+
+from app.database.connection import AsyncSessionLocal
+from app.models.models import MpesaCallbackLog
+from app.payments.payments import process_logged_callback
+
+log = logging.getLogger(__name__)
+
+MPESA_CALLBACK_WORKERS = int(os.getenv("MPESA_CALLBACK_WORKERS", 4))
+# Logged callbacks waiting in memory; beyond this they wait for the sweep
+MPESA_CALLBACK_QUEUE_SIZE = int(os.getenv("MPESA_CALLBACK_QUEUE_SIZE", 1000))
+MPESA_CALLBACK_SWEEP_SECONDS = float(os.getenv("MPESA_CALLBACK_SWEEP_SECONDS", 60))
+# Rows younger than this are assumed to be in some worker's queue already
+MPESA_CALLBACK_SWEEP_GRACE_SECONDS = float(os.getenv("MPESA_CALLBACK_SWEEP_GRACE_SECONDS", 30))
+
+
+class CallbackProcessor:
+    """Applies logged M-Pesa callbacks off the request path.
+
+    The callback endpoint only persists the raw body and calls ``submit``;
+    a fixed pool of consumers drains a bounded queue, each with its own
+    session. When the queue is full the row is simply left unprocessed:
+    it is already durable, and the periodic sweep (which also runs at
+    startup) picks up anything logged but never processed.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        workers: int = MPESA_CALLBACK_WORKERS,
+        max_queue: int = MPESA_CALLBACK_QUEUE_SIZE,
+        sweep_seconds: float = MPESA_CALLBACK_SWEEP_SECONDS,
+        sweep_grace_seconds: float = MPESA_CALLBACK_SWEEP_GRACE_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.max_queue = max_queue
+        self.sweep_seconds = sweep_seconds
+        self.sweep_grace_seconds = sweep_grace_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        # Log ids queued or being processed, so the sweep never doubles them up
+        self._in_flight: Set[int] = set()
+        self._started_at: Optional[datetime] = None
+        self.enqueued = 0
+        self.deferred = 0
+        self.processed = 0
+        self.errors = 0
+        self.swept = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self.lag_seconds_total = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._started_at = datetime.utcnow()
+        self._tasks = [
+            asyncio.create_task(self._consume(), name=f"mpesa-callback-{i}") for i in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._sweep_loop(), name="mpesa-callback-sweep"))
+
+    async def stop(self) -> None:
+        # Anything still queued stays unprocessed in the log and is swept on the next start
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._in_flight.clear()
+
+    def submit(self, log_id: int) -> bool:
+        """Queue a logged callback; False if the pool is not running or is full."""
+        if self._queue is None or log_id in self._in_flight:
+            return False
+        try:
+            self._queue.put_nowait((log_id, time.monotonic()))
+        except asyncio.QueueFull:
+            self.deferred += 1
+            log.warning("M-Pesa callback queue full, log %s left for the sweep", log_id)
+            return False
+        self._in_flight.add(log_id)
+        self.enqueued += 1
+        return True
+
+    async def _consume(self) -> None:
+        while True:
+            log_id, enqueued_at = await self._queue.get()
+            lag = time.monotonic() - enqueued_at
+            self.last_lag_seconds = lag
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+            self.lag_seconds_total += lag
+            try:
+                async with self.session_factory() as db:
+                    await process_logged_callback(db, log_id)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Row stays unprocessed; the sweep retries it
+                self.errors += 1
+                log.exception("Processing M-Pesa callback log %s failed", log_id)
+            finally:
+                self._in_flight.discard(log_id)
+                self._queue.task_done()
+
+    async def sweep(self) -> int:
+        """Queue logged callbacks that were never processed; returns how many were queued."""
+        if self._queue is None:
+            return 0
+        # Anything logged before start() was left over from a previous run
+        cutoff = max(datetime.utcnow() - timedelta(seconds=self.sweep_grace_seconds), self._started_at)
+        room = self._queue.maxsize - self._queue.qsize()
+        if room <= 0:
+            return 0
+        async with self.session_factory() as db:
+            ids = (
+                await db.execute(
+                    select(MpesaCallbackLog.id)
+                    .where(MpesaCallbackLog.processed_at.is_(None))
+                    .where(MpesaCallbackLog.received_at <= cutoff)
+                    .order_by(MpesaCallbackLog.id)
+                    .limit(room + len(self._in_flight))
+                )
+            ).scalars().all()
+        queued = sum(self.submit(log_id) for log_id in ids)
+        self.swept += queued
+        return queued
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("M-Pesa callback sweep failed")
+            await asyncio.sleep(self.sweep_seconds)
+
+    def stats(self) -> dict:
+        completed = self.processed + self.errors
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": len(self._in_flight),
+            "enqueued": self.enqueued,
+            "deferred": self.deferred,
+            "swept": self.swept,
+            "processed": self.processed,
+            "errors": self.errors,
+            # Time from submit() until a consumer picked the callback up
+            "last_lag_seconds": round(self.last_lag_seconds, 3),
+            "max_lag_seconds": round(self.max_lag_seconds, 3),
+            "avg_lag_seconds": round(self.lag_seconds_total / completed, 3) if completed else 0.0,
+        }
+
+
+callback_processor = CallbackProcessor()
@@ -0,0 +1,287 @@
+import json
+import logging
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.EMail.email_templates import render_payment_receipt
+from app.EMail.outbox import email_worker, enqueue_email
+from app.inventory.inventory import CANCELLED_STATUS, cancel_order
+from app.models.models import MpesaCallbackLog, Order, Payment
+from app.utils.cache import invalidate_products
+from app.utils.metrics import MPESA_CALLBACK_OUTCOMES, MPESA_CALLBACKS
+
+log = logging.getLogger(__name__)
+
+PENDING = "PENDING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+# Completed, but for less than the order total: the order is left unpaid
+UNDERPAID = "UNDERPAID"
+
+# Order.status once its payment has completed
+PAID_STATUS = "paid"
+RECEIPT_EMAIL_SUBJECT = "Payment received - Smart Indoor Decors"
+
+# MpesaCallbackLog.outcome values
+APPLIED = "applied"
+DUPLICATE = "duplicate"
+UNKNOWN_PAYMENT = "unknown_payment"
+AMOUNT_MISMATCH = "amount_mismatch"
+# A success callback for a payment already failed (e.g. expired by the
+# reconciler): the customer was charged for a cancelled order
+PAID_AFTER_FAIL = "paid_after_fail"
+ERROR = "error"
+
+
+class StkCallback(NamedTuple):
+    checkout_request_id: str
+    result_code: int
+    receipt_number: Optional[str] = None
+    amount: Optional[float] = None
+    phone_number: Optional[str] = None
+
+
+class CallbackOutcome(NamedTuple):
+    outcome: str
+    status: Optional[str] = None  # payment status after processing
+    payment_id: Optional[int] = None
+    order_id: Optional[int] = None
+    restocked: List[int] = []
+    receipt_queued: bool = False
+
+
+def parse_stk_callback(data: dict) -> StkCallback:
+    """Pull the fields we use out of a Daraja STK callback body.
+
+    Raises KeyError/TypeError/ValueError on a malformed payload.
+    """
+    cb = data["Body"]["stkCallback"]
+    result_code = int(cb["ResultCode"])
+    if result_code != 0:
+        return StkCallback(cb["CheckoutRequestID"], result_code)
+
+    meta = {i["Name"]: i.get("Value") for i in cb["CallbackMetadata"]["Item"]}
+    phone_number = meta.get("PhoneNumber")
+    return StkCallback(
+        checkout_request_id=cb["CheckoutRequestID"],
+        result_code=result_code,
+        receipt_number=meta.get("MpesaReceiptNumber"),
+        amount=meta.get("Amount"),
+        phone_number=str(phone_number) if phone_number is not None else None,
+    )
+
+
+async def apply_stk_callback(db: AsyncSession, cb: StkCallback) -> CallbackOutcome:
+    """Settle the payment a callback refers to, at most once.
+
+    A single ``UPDATE ... WHERE status = 'PENDING' RETURNING`` both checks
+    and settles the payment, so retried or concurrent deliveries of the
+    same callback cannot apply twice: only one of them gets a row back. A
+    failed payment cancels its order and releases the stock; a completed one
+    marks its order paid and queues the customer's receipt in the email
+    outbox, provided it covers the order total (otherwise the payment is
+    flagged UNDERPAID and the order stays unpaid). Does not commit.
+    """
+    now = datetime.utcnow()
+    if cb.result_code == 0:
+        details = dict(
+            mpesa_receipt_number=cb.receipt_number, amount=cb.amount, phone_number=cb.phone_number,
+        )
+        # An STK Query result carries no receipt details; keep what we have
+        values = dict(
+            status=COMPLETED,
+            transaction_date=now,
+            **{k: v for k, v in details.items() if v is not None},
+        )
+    else:
+        values = dict(status=FAILED)
+
+    result = await db.execute(
+        update(Payment)
+        .where(Payment.checkout_request_id == cb.checkout_request_id)
+        .where(Payment.status == PENDING)
+        .values(updated_at=now, **values)
+        .returning(Payment.id, Payment.order_id, Payment.status, Payment.amount)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.first()
+    if row is None:
+        existing = (
+            await db.execute(
+                select(Payment.id, Payment.order_id, Payment.status)
+                .where(Payment.checkout_request_id == cb.checkout_request_id)
+            )
+        ).first()
+        if existing is None:
+            return CallbackOutcome(UNKNOWN_PAYMENT)
+        payment_id, order_id, current = existing
+        if current == FAILED and cb.result_code == 0:
+            # Needs a refund: the order was cancelled and its stock released
+            log.error(
+                "Payment %s (id %s, order %s) succeeded after it was marked FAILED; receipt %s, amount %s",
+                cb.checkout_request_id, payment_id, order_id, cb.receipt_number, cb.amount,
+            )
+            return CallbackOutcome(PAID_AFTER_FAIL, current, payment_id, order_id)
+        if current == COMPLETED and cb.receipt_number:
+            # Settled earlier by the reconciler; record the receipt it could not see
+            await db.execute(
+                update(Payment)
+                .where(Payment.checkout_request_id == cb.checkout_request_id)
+                .where(Payment.mpesa_receipt_number.is_(None))
+                .values(mpesa_receipt_number=cb.receipt_number, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+        return CallbackOutcome(DUPLICATE, status=current)
+
+    payment_id, order_id, status, amount = row
+    restocked, receipt_queued = [], False
+    if status == FAILED and order_id is not None:
+        restocked = await cancel_order(db, order_id) or []
+    elif status == COMPLETED and order_id is not None:
+        receipt_queued = await _mark_order_paid(db, order_id, amount, cb, now)
+        if not receipt_queued and await _flag_underpayment(db, payment_id, order_id, amount, cb, now):
+            return CallbackOutcome(AMOUNT_MISMATCH, UNDERPAID, payment_id, order_id)
+    return CallbackOutcome(APPLIED, status, payment_id, order_id, restocked, receipt_queued)
+
+
+async def _mark_order_paid(
+    db: AsyncSession, order_id: int, amount: Optional[float], cb: StkCallback, now: datetime
+) -> bool:
+    """Move the order to paid and queue the receipt.
+
+    False if the order is cancelled or missing, or ``amount`` (what the
+    payment row says was paid) does not cover its total.
+    """
+    order = (
+        await db.execute(
+            update(Order)
+            .where(Order.id == order_id)
+            .where(Order.status != CANCELLED_STATUS)
+            .where(Order.total_amount <= amount)
+            .values(status=PAID_STATUS, updated_at=now)
+            .returning(Order.customer_name, Order.customer_email)
+            .execution_options(synchronize_session=False)
+        )
+    ).first()
+    if order is None:
+        return False
+
+    customer_name, customer_email = order
+    html, text = render_payment_receipt(customer_name, order_id, cb.receipt_number, amount)
+    enqueue_email(db, RECEIPT_EMAIL_SUBJECT, customer_email, html, text)
+    return True
+
+
+async def _flag_underpayment(
+    db: AsyncSession, payment_id: int, order_id: int, amount: Optional[float], cb: StkCallback, now: datetime
+) -> bool:
+    """After ``_mark_order_paid`` refused: flag the payment UNDERPAID if it fell short; True if so."""
+    order = (
+        await db.execute(select(Order.status, Order.total_amount).where(Order.id == order_id))
+    ).first()
+    if order is None or order.status == CANCELLED_STATUS:
+        # Stock was already released; this needs a refund rather than a silent fix
+        log.error("Payment %s completed for cancelled or missing order %s", cb.checkout_request_id, order_id)
+        return False
+
+    await db.execute(
+        update(Payment)
+        .where(Payment.id == payment_id)
+        .values(status=UNDERPAID, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    log.error(
+        "Payment %s paid %s against order %s totalling %s; order left unpaid",
+        cb.checkout_request_id, amount, order_id, order.total_amount,
+    )
+    return True
+
+
+async def log_stk_callback(db: AsyncSession, raw: str) -> int:
+    """Persist a raw callback body before it is interpreted; commits and returns the log id."""
+    checkout_request_id, result_code = None, None
+    try:
+        cb = json.loads(raw)["Body"]["stkCallback"]
+        checkout_request_id = cb.get("CheckoutRequestID")
+        result_code = int(cb["ResultCode"])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass  # still logged; processing reports the error
+    MPESA_CALLBACKS.inc("malformed" if result_code is None else result_code)
+
+    entry = MpesaCallbackLog(
+        checkout_request_id=checkout_request_id,
+        result_code=result_code,
+        payload=raw,
+        received_at=datetime.utcnow(),
+    )
+    db.add(entry)
+    await db.flush()
+    log_id = entry.id
+    await db.commit()
+    return log_id
+
+
+async def process_logged_callback(db: AsyncSession, log_id: int) -> CallbackOutcome:
+    """Apply a logged callback and record the outcome on its log row.
+
+    Safe to call any number of times for the same row (replay), since
+    ``apply_stk_callback`` only settles a PENDING payment. Commits.
+    """
+    payload = await db.scalar(select(MpesaCallbackLog.payload).where(MpesaCallbackLog.id == log_id))
+    if payload is None:
+        raise LookupError(f"Callback log {log_id} not found")
+
+    error = None
+    try:
+        outcome = await apply_stk_callback(db, parse_stk_callback(json.loads(payload)))
+    except (ValueError, KeyError, TypeError) as e:
+        outcome, error = CallbackOutcome(ERROR), f"Malformed callback: {e!r}"
+    except IntegrityError as e:
+        # e.g. a receipt number already recorded against another payment
+        await db.rollback()
+        outcome, error = CallbackOutcome(ERROR), str(e.orig)[:1000]
+
+    await db.execute(
+        update(MpesaCallbackLog)
+        .where(MpesaCallbackLog.id == log_id)
+        .values(processed_at=datetime.utcnow(), outcome=outcome.outcome, error=error)
+    )
+    await db.commit()
+
+    MPESA_CALLBACK_OUTCOMES.inc(outcome.outcome)
+    if error:
+        log.error("M-Pesa callback %s not applied: %s", log_id, error)
+    await _after_commit(outcome)
+    return outcome
+
+
+async def settle_payment(db: AsyncSession, cb: StkCallback) -> CallbackOutcome:
+    """Apply a result obtained without a callback (e.g. STK Query) and commit."""
+    outcome = await apply_stk_callback(db, cb)
+    await db.commit()
+    await _after_commit(outcome)
+    return outcome
+
+
+async def _after_commit(outcome: CallbackOutcome) -> None:
+    if outcome.restocked:
+        await invalidate_products(*outcome.restocked)
+    if outcome.receipt_queued:
+        email_worker.wake()
+
+
+async def replay_unprocessed_callbacks(db: AsyncSession, limit: int = 100) -> List[CallbackOutcome]:
+    """Process logged callbacks that never finished (e.g. the worker crashed)."""
+    ids = (
+        await db.execute(
+            select(MpesaCallbackLog.id)
+            .where(MpesaCallbackLog.processed_at.is_(None))
+            .order_by(MpesaCallbackLog.id)
+            .limit(limit)
+        )
+    ).scalars().all()
+    return [await process_logged_callback(db, log_id) for log_id in ids]
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import httpx
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.connection import AsyncSessionLocal
+from app.models.models import Payment
+from app.payments.payments import APPLIED, COMPLETED, PENDING, StkCallback, settle_payment
+from app.routers.mpesa_auth import query_stk_push
+
+log = logging.getLogger(__name__)
+
+MPESA_RECONCILE_ENABLED = os.getenv("MPESA_RECONCILE_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+MPESA_RECONCILE_INTERVAL_SECONDS = float(os.getenv("MPESA_RECONCILE_INTERVAL_SECONDS", 60))
+# A PENDING payment untouched for this long is queried (callbacks normally land within seconds)
+MPESA_RECONCILE_STALE_SECONDS = float(os.getenv("MPESA_RECONCILE_STALE_SECONDS", 120))
+# Past this age a push Daraja still reports as in flight cannot complete any more; it is failed
+MPESA_RECONCILE_MAX_AGE_SECONDS = float(os.getenv("MPESA_RECONCILE_MAX_AGE_SECONDS", 24 * 3600))
+MPESA_RECONCILE_BATCH_SIZE = int(os.getenv("MPESA_RECONCILE_BATCH_SIZE", 50))
+MPESA_RECONCILE_CONCURRENCY = int(os.getenv("MPESA_RECONCILE_CONCURRENCY", 4))
+# Daraja throttles per app; stay well under it so STK pushes are not starved
+MPESA_RECONCILE_RATE_PER_SECOND = float(os.getenv("MPESA_RECONCILE_RATE_PER_SECOND", 5))
+
+# Daraja's "transaction is being processed" answers: ask again next round
+STILL_PROCESSING_ERROR_CODE = "500.001.1001"
+STILL_PROCESSING_RESULT_CODE = 4999
+# "DS timeout": used when a push is failed for being too old to complete
+EXPIRED_RESULT_CODE = 1037
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart across all callers."""
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+        self.throttled = 0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            self.throttled += 1
+            await asyncio.sleep(wait)
+
+
+def interpret_stk_query(response: httpx.Response) -> Optional[int]:
+    """Return the STK result code, or None while the payment is still in flight.
+
+    Raises ValueError for a response that says nothing about the payment.
+    """
+    try:
+        data = response.json()
+    except ValueError:
+        raise ValueError(f"STK query HTTP {response.status_code}: non-JSON body")
+    if response.status_code != 200:
+        if data.get("errorCode") == STILL_PROCESSING_ERROR_CODE:
+            return None
+        raise ValueError(f"STK query HTTP {response.status_code}: {data.get('errorMessage') or data}")
+    result_code = int(data["ResultCode"])
+    return None if result_code == STILL_PROCESSING_RESULT_CODE else result_code
+
+
+async def claim_stale_payments(
+    db: AsyncSession, limit: int, stale_seconds: float
+) -> List[Tuple[int, str, datetime]]:
+    """Pick PENDING payments nobody has heard about for a while and mark them checked.
+
+    Bumping ``updated_at`` moves them to the back of the line, so payments
+    Daraja still reports as processing do not crowd out the rest, and
+    concurrent reconcilers (FOR UPDATE SKIP LOCKED) never query the same one.
+    """
+    now = datetime.utcnow()
+    stale = (
+        select(Payment.id)
+        .where(Payment.status == PENDING)
+        .where(Payment.checkout_request_id.is_not(None))
+        .where(Payment.updated_at < now - timedelta(seconds=stale_seconds))
+        .order_by(Payment.updated_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(Payment)
+        .where(Payment.id.in_(stale.scalar_subquery()))
+        .values(updated_at=now)
+        .returning(Payment.id, Payment.checkout_request_id, Payment.created_at)
+        .execution_options(synchronize_session=False)
+    )
+    return [tuple(row) for row in result.all()]
+
+
+class PaymentReconciler:
+    """Background task that settles PENDING payments whose callback never came.
+
+    Each round claims a batch of stale payments and asks Daraja's STK Query
+    API about them, at most ``concurrency`` at a time and no faster than
+    ``rate_per_second``. Answers are applied exactly like callbacks
+    (``settle_payment``), so a late callback for the same payment is a
+    harmless duplicate.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        query=query_stk_push,
+        interval_seconds: float = MPESA_RECONCILE_INTERVAL_SECONDS,
+        stale_seconds: float = MPESA_RECONCILE_STALE_SECONDS,
+        max_age_seconds: float = MPESA_RECONCILE_MAX_AGE_SECONDS,
+        batch_size: int = MPESA_RECONCILE_BATCH_SIZE,
+        concurrency: int = MPESA_RECONCILE_CONCURRENCY,
+        rate_per_second: float = MPESA_RECONCILE_RATE_PER_SECOND,
+    ):
+        self.session_factory = session_factory
+        self.query = query
+        self.interval_seconds = interval_seconds
+        self.stale_seconds = stale_seconds
+        self.max_age_seconds = max_age_seconds
+        self.batch_size = batch_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self._task: Optional[asyncio.Task] = None
+        self.rounds = 0
+        self.queried = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.still_pending = 0
+        self.errors = 0
+        self.last_round_at: Optional[datetime] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="mpesa-reconciler")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                claimed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Payment reconciliation round failed")
+                claimed = 0
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self) -> int:
+        """Query and settle one batch; returns the number of payments claimed."""
+        async with self.session_factory() as db:
+            claimed = await claim_stale_payments(db, self.batch_size, self.stale_seconds)
+            await db.commit()
+        self.rounds += 1
+        self.last_round_at = datetime.utcnow()
+        await asyncio.gather(*(self._reconcile(*payment) for payment in claimed))
+        return len(claimed)
+
+    async def _reconcile(self, payment_id: int, checkout_request_id: str, created_at: datetime) -> None:
+        async with self._semaphore:
+            try:
+                await self.rate_limiter.acquire()
+                self.queried += 1
+                result_code = interpret_stk_query(await self.query(checkout_request_id))
+            except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+                # No answer is not evidence the push failed: never expire on it,
+                # the payment stays PENDING and is queried again next round
+                self.errors += 1
+                log.warning("STK query for payment %s failed: %s", payment_id, e)
+                return
+
+            expired = created_at is not None and (
+                datetime.utcnow() - created_at > timedelta(seconds=self.max_age_seconds)
+            )
+            if result_code is None and not expired:
+                self.still_pending += 1
+                return
+            if result_code is None:
+                result_code = EXPIRED_RESULT_CODE
+                self.expired += 1
+
+            try:
+                async with self.session_factory() as db:
+                    outcome = await settle_payment(db, StkCallback(checkout_request_id, result_code))
+            except Exception:
+                self.errors += 1
+                log.exception("Settling payment %s from STK query failed", payment_id)
+                return
+            if outcome.outcome != APPLIED:
+                return  # a callback got there first, or it was flagged (and logged) as underpaid
+            if outcome.status == COMPLETED:
+                self.completed += 1
+            else:
+                self.failed += 1
+            log.info("Reconciled payment %s as %s (result code %s)", payment_id, outcome.status, result_code)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "rounds": self.rounds,
+            "last_round_at": self.last_round_at.isoformat() if self.last_round_at else None,
+            "queried": self.queried,
+            "settled_completed": self.completed,
+            "settled_failed": self.failed,
+            "expired": self.expired,
+            "still_pending": self.still_pending,
+            "errors": self.errors,
+            "throttled": self.rate_limiter.throttled,
+            "concurrency": self.concurrency,
+        }
+
+
+payment_reconciler = PaymentReconciler()
@@ -70,14 +70,17 @@
 
 
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import Literal, Union
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from app.cart.cart import cart_summary, load_cart, load_cart_lines
+from app.database.connection import dialect_insert
 
-from app.models.models import Cart, Product, User, CartItem
-from app.auth.auth import get_current_user, get_db
-from app.schemas.schema import CartOut
+from app.models.models import Cart
+from app.auth.auth import get_current_principal, get_db
+from app.schemas.schema import CartCompactOut, CartOut, CartSummaryOut, Principal
 
 router = APIRouter()
 
@@ -85,47 +88,48 @@ router = APIRouter()
 @router.post("/", response_model=CartOut, status_code=status.HTTP_201_CREATED)
 async def create_cart(
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
-    result = await db.execute(select(Cart).where(Cart.user_id == current_user.id))
-    existing_cart = result.scalar_one_or_none()
-
-    if existing_cart:
+    # The unique carts.user_id index decides "already exists", even under concurrent calls
+    now = datetime.utcnow()
+    result = await db.execute(
+        dialect_insert(db)(Cart)
+        .values(user_id=current_user.id, created_at=now, updated_at=now)
+        .on_conflict_do_nothing(index_elements=[Cart.user_id])
+        .returning(Cart.id)
+    )
+    cart_id = result.scalar_one_or_none()
+    if cart_id is None:
         raise HTTPException(status_code=400, detail="Cart already exists")
 
-    new_cart = Cart(user_id=current_user.id)
-    db.add(new_cart)
     await db.commit()
-    await db.refresh(new_cart)
-    return new_cart
+    return CartOut(id=cart_id, user_id=current_user.id, created_at=now, updated_at=now, cart_items=[])
 
 
 # ========== GET USER'S CART ==========
-@router.get("/", response_model=CartOut)
+@router.get("/", response_model=Union[CartCompactOut, CartSummaryOut, CartOut])
 async def get_cart(
+    view: Literal["compact", "summary", "full"] = Query(
+        "compact",
+        description="compact: flat lines with totals; summary: item count and subtotal only "
+                    "(zeros when there is no cart); full: lines with the nested product",
+    ),
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
-    result = await db.execute(
-        select(Cart)
-        .options(
-            selectinload(Cart.cart_items)
-                .selectinload(CartItem.product)
-                .selectinload(Product.category),
-            selectinload(Cart.cart_items)
-                .selectinload(CartItem.product)
-                .selectinload(Product.images),
-            selectinload(Cart.cart_items)
-                .selectinload(CartItem.product)
-                .selectinload(Product.videos),
-        )
-        .where(Cart.user_id == current_user.id)
-    )
-    cart = result.scalar_one_or_none()
+    if view == "summary":
+        return await cart_summary(db, current_user.id)
+
+    if view == "compact":
+        cart = await load_cart_lines(db, current_user.id)
+    else:
+        cart = await load_cart(db, current_user.id)
 
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
 
+    if view == "full":
+        return CartOut.model_validate(cart, from_attributes=True)
     return cart
 
 
@@ -133,7 +137,7 @@ async def get_cart(
 @router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_cart(
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     result = await db.execute(select(Cart).where(Cart.user_id == current_user.id))
     cart = result.scalar_one_or_none()
@@ -1,9 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.models.models import Cart, CartItem, Product, User
-from app.auth.auth import get_current_user, get_db
-from app.schemas.schema import CartItemCreate, CartItemUpdate
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.auth.auth import get_current_principal, get_db
+from app.cart.cart import (
+    add_cart_item, fold_operations, get_or_create_cart_id, load_cart, remove_cart_item,
+    remove_cart_items, set_cart_item_quantity, touch_cart, upsert_cart_items,
+)
+from app.models.models import Product
+from app.schemas.schema import CartBatchUpdate, CartItemCreate, CartItemUpdate, CartOut, Principal
 
 router = APIRouter()
 
@@ -12,25 +17,15 @@ router = APIRouter()
 async def add_item_to_cart(
     item: CartItemCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
-    cart_result = await db.execute(select(Cart).where(Cart.user_id == current_user.id))
-    cart = cart_result.scalar_one_or_none()
-    if not cart:
-        raise HTTPException(status_code=404, detail="Cart not found")
-
-    item_result = await db.execute(
-        select(CartItem)
-        .where(CartItem.cart_id == cart.id)
-        .where(CartItem.product_id == item.product_id)
-    )
-    cart_item = item_result.scalar_one_or_none()
-
-    if cart_item:
-        cart_item.quantity += item.quantity
-    else:
-        cart_item = CartItem(cart_id=cart.id, product_id=item.product_id, quantity=item.quantity)
-        db.add(cart_item)
+    # Two statements: get-or-create the cart, then upsert the line
+    try:
+        cart_id = await get_or_create_cart_id(db, current_user.id)
+        await add_cart_item(db, cart_id, item.product_id, item.quantity)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Product not found")
 
     await db.commit()
     return {"message": "Item added to cart"}
@@ -41,23 +36,15 @@ async def add_item_to_cart(
 async def update_cart_item(
     item: CartItemUpdate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
-    cart_result = await db.execute(select(Cart).where(Cart.user_id == current_user.id))
-    cart = cart_result.scalar_one_or_none()
-    if not cart:
+    cart_id = await touch_cart(db, current_user.id)
+    if cart_id is None:
         raise HTTPException(status_code=404, detail="Cart not found")
-
-    item_result = await db.execute(
-        select(CartItem)
-        .where(CartItem.cart_id == cart.id)
-        .where(CartItem.product_id == item.product_id)
-    )
-    cart_item = item_result.scalar_one_or_none()
-    if not cart_item:
+    if not await set_cart_item_quantity(db, cart_id, item.product_id, item.quantity):
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Cart item not found")
 
-    cart_item.quantity = item.quantity
     await db.commit()
     return {"message": "Cart item updated"}
 
@@ -67,21 +54,50 @@ async def update_cart_item(
 async def delete_cart_item(
     product_id: int,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
-    cart_result = await db.execute(select(Cart).where(Cart.user_id == current_user.id))
-    cart = cart_result.scalar_one_or_none()
-    if not cart:
+    cart_id = await touch_cart(db, current_user.id)
+    if cart_id is None:
         raise HTTPException(status_code=404, detail="Cart not found")
-
-    item_result = await db.execute(
-        select(CartItem)
-        .where(CartItem.cart_id == cart.id)
-        .where(CartItem.product_id == product_id)
-    )
-    cart_item = item_result.scalar_one_or_none()
-    if not cart_item:
+    if not await remove_cart_item(db, cart_id, product_id):
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Cart item not found")
 
-    await db.delete(cart_item)
-    await db.commit()
\ No newline at end of file
+    await db.commit()
+
+
+# BATCH ADD / SET / REMOVE
+@router.patch("/cart/items:batch", response_model=CartOut)
+async def batch_update_cart_items(
+    batch: CartBatchUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal)
+):
+    """Apply many cart operations atomically and return the resulting cart.
+
+    Operations run in order, but are first folded to one effect per product,
+    so the whole batch costs at most one DELETE and two multi-row upserts
+    whatever its length.
+    """
+    increments, absolute, removed = fold_operations(batch.operations)
+
+    wanted = set(increments) | set(absolute)
+    if wanted:
+        found = set((await db.execute(select(Product.id).where(Product.id.in_(wanted)))).scalars())
+        missing = sorted(wanted - found)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Products not found: {missing}")
+
+    try:
+        cart_id = await get_or_create_cart_id(db, current_user.id)
+        await remove_cart_items(db, cart_id, removed)
+        await upsert_cart_items(db, cart_id, absolute, increment=False)
+        await upsert_cart_items(db, cart_id, increments, increment=True)
+    except IntegrityError:
+        # A product deleted since the check above
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Product not found")
+    await db.commit()
+
+    # Serialise before the session closes so nothing lazy-loads afterwards
+    return CartOut.model_validate(await load_cart(db, current_user.id), from_attributes=True)
\ No newline at end of file
@@ -1,10 +1,15 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models.models import Category, User  # your models
-from app.schemas.schema import CategoryCreate, CategoryUpdate, CategoryOut  # your schemas
-from app.auth.auth import get_db, get_current_user  # your dependencies
+from app.models.models import Category, Product, User  # your models
+from app.schemas.schema import CategoryCreate, CategoryUpdate, CategoryOut, Principal  # your schemas
+from app.auth.auth import get_db, get_current_principal, get_current_user  # your dependencies
+from app.search.search import search_backend
+from app.search.suggest import suggest_index
+from app.utils.cache import PRODUCT_LIST_TAG, SITEMAP_TAG, category_tag, response_cache
+from app.utils.http_cache import is_not_modified, not_modified_response, validator_headers
+from app.utils.pagination import paginate, set_next_cursor
 
 router = APIRouter()
 
@@ -23,31 +28,53 @@ async def create_category(
     db.add(new_category)
     await db.commit()
     await db.refresh(new_category)
+    suggest_index.add_category(new_category.id, new_category.name)
     return new_category
 
 
+def _validators(categories) -> dict:
+    stamps = [c.updated_at for c in categories if c.updated_at is not None]
+    return validator_headers(
+        len(categories), max(stamps) if stamps else None, [c.id for c in categories]
+    )
+
+
 @router.get("/categories", response_model=List[CategoryOut], summary="Get all categories")
 async def get_categories(
+    request: Request,
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
-    result = await db.execute(select(Category).offset(skip).limit(limit))
+    result = await db.execute(paginate(select(Category), Category.id, skip, limit, cursor))
     categories = result.scalars().all()
+    headers = _validators(categories)
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    response.headers.update(headers)
+    set_next_cursor(response, categories, limit)
     return categories
 
 
 @router.get("/{category_id}", response_model=CategoryOut, summary="Get category by ID")
 async def get_category(
     category_id: int,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     result = await db.execute(select(Category).where(Category.id == category_id))
     category = result.scalar_one_or_none()
     if not category:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
+    headers = _validators([category])
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    response.headers.update(headers)
     return category
 
 
@@ -74,6 +101,9 @@ async def update_category(
 
     await db.commit()
     await db.refresh(category)
+    suggest_index.add_category(category.id, category.name)
+    # Products embed their category, so cached product responses go too
+    await response_cache.invalidate(PRODUCT_LIST_TAG, category_tag(category_id))
 
     return category
 
@@ -92,6 +122,19 @@ async def delete_category(
     if not category:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
 
+    # The ORM keeps the category's products and sets their category_id to
+    # NULL. A product without a category cannot be served (ProductOut needs
+    # one), so it leaves the search and suggestion indexes too.
+    orphaned = (
+        await db.execute(select(Product.id).where(Product.category_id == category_id))
+    ).scalars().all()
     await db.delete(category)
     await db.commit()
+    suggest_index.remove_category(category_id)
+    for product_id in orphaned:
+        search_backend.remove_product(product_id)
+        suggest_index.remove_product(product_id)
+    # The products stay listed in the sitemaps, but nulling their category_id
+    # bumps updated_at (their <lastmod>), so cached sitemaps are stale
+    await response_cache.invalidate(PRODUCT_LIST_TAG, SITEMAP_TAG, category_tag(category_id))
     return  # 204 No Content
\ No newline at end of file
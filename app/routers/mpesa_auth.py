@@ -1,11 +1,16 @@
+import asyncio
+import math
+import time
 import httpx
 from base64 import b64encode
 from datetime import datetime
 from os import getenv
+from typing import Optional
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models.models import Payment
+from app.models.models import Order, Payment
+from app.utils.metrics import MPESA_STK_PUSHES
 
 MPESA_BASE_URL = getenv("MPESA_BASE_URL")
 CONSUMER_KEY   = getenv("MPESA_CONSUMER_KEY")
@@ -14,28 +19,144 @@ SHORTCODE      = getenv("MPESA_SHORTCODE")
 PASSKEY        = getenv("MPESA_PASSKEY")
 CALLBACK_URL   = getenv("MPESA_CALLBACK_URL")
 
+# Order.status of an order that can still be paid
+ORDER_PENDING_STATUS = "pending"
+
+# --- HTTP client tuning ---
+MPESA_CONNECT_TIMEOUT       = float(getenv("MPESA_CONNECT_TIMEOUT", 5))
+MPESA_READ_TIMEOUT          = float(getenv("MPESA_READ_TIMEOUT", 30))
+MPESA_MAX_CONNECTIONS       = int(getenv("MPESA_MAX_CONNECTIONS", 20))
+# Refresh the OAuth token this many seconds before Daraja says it expires
+MPESA_TOKEN_REFRESH_MARGIN  = float(getenv("MPESA_TOKEN_REFRESH_MARGIN", 60))
+
+
+class DarajaClient:
+    """Long-lived Daraja API client.
+
+    Keeps one pooled ``httpx.AsyncClient`` (so TLS connections are reused
+    across payments) and caches the OAuth token until shortly before it
+    expires. Concurrent callers share a single token refresh.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = MPESA_BASE_URL,
+        consumer_key: Optional[str] = CONSUMER_KEY,
+        consumer_secret: Optional[str] = CONSUMER_SECRET,
+        timeout: Optional[httpx.Timeout] = None,
+        max_connections: int = MPESA_MAX_CONNECTIONS,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self._basic_auth = b64encode(f"{consumer_key}:{consumer_secret}".encode()).decode()
+        self._http = httpx.AsyncClient(
+            base_url=base_url or "",
+            timeout=timeout or httpx.Timeout(MPESA_READ_TIMEOUT, connect=MPESA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            transport=transport,
+        )
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+
+    def _cached_token(self) -> Optional[str]:
+        if self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+        return None
+
+    async def get_access_token(self, stale_token: Optional[str] = None) -> str:
+        """Return a valid token, fetching a new one only when needed.
+
+        Pass ``stale_token`` after a 401 to force a refresh unless another
+        caller has already replaced that token.
+        """
+        token = self._cached_token()
+        if token and token != stale_token:
+            return token
+
+        async with self._token_lock:
+            token = self._cached_token()
+            if token and token != stale_token:
+                return token
+
+            response = await self._http.get(
+                "/oauth/v1/generate",
+                params={"grant_type": "client_credentials"},
+                headers={"Authorization": f"Basic {self._basic_auth}"},
+            )
+            if response.status_code != 200:
+                raise HTTPException(500, "Failed to get M-Pesa access token")
+
+            data = response.json()
+            expires_in = float(data.get("expires_in", 3599))
+            self._token = data["access_token"]
+            self._token_expires_at = (
+                time.monotonic() + max(expires_in - MPESA_TOKEN_REFRESH_MARGIN, 0)
+            )
+            return self._token
+
+    async def post(self, path: str, payload: dict) -> httpx.Response:
+        """POST to an authenticated Daraja endpoint, retrying once on 401."""
+        token = await self.get_access_token()
+        response = await self._http.post(
+            path, json=payload, headers={"Authorization": f"Bearer {token}"}
+        )
+        if response.status_code == 401:
+            token = await self.get_access_token(stale_token=token)
+            response = await self._http.post(
+                path, json=payload, headers={"Authorization": f"Bearer {token}"}
+            )
+        return response
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+_daraja_client: Optional[DarajaClient] = None
+
+
+def get_daraja_client() -> DarajaClient:
+    """Shared client; created in the app lifespan, or lazily on first use."""
+    global _daraja_client
+    if _daraja_client is None:
+        _daraja_client = DarajaClient()
+    return _daraja_client
+
+
+async def close_daraja_client() -> None:
+    global _daraja_client
+    if _daraja_client is not None:
+        await _daraja_client.aclose()
+        _daraja_client = None
 
-async def get_mpesa_access_token() -> str:
-    url  = f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-    auth = b64encode(f"{CONSUMER_KEY}:{CONSUMER_SECRET}".encode()).decode()
-    headers = {"Authorization": f"Basic {auth}"}
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
+async def get_mpesa_access_token() -> str:
+    return await get_daraja_client().get_access_token()
 
-    if response.status_code != 200:
-        raise HTTPException(500, "Failed to get M-Pesa access token")
 
-    return response.json()["access_token"]
+def stk_password() -> tuple:
+    """Return (password, timestamp) for an STK request signed with the passkey."""
+    timestamp    = datetime.now().strftime("%Y%m%d%H%M%S")
+    password     = b64encode(f"{SHORTCODE}{PASSKEY}{timestamp}".encode()).decode()
+    return password, timestamp
 
 
-async def send_stk_push(phone_number: str, amount: float, order_id: int, db: AsyncSession):
+async def send_stk_push(phone_number: str, order_id: int, db: AsyncSession):
     if db is None:
         raise ValueError("Database session (db) was not provided to send_stk_push")
 
-    access_token = await get_mpesa_access_token()
-    timestamp    = datetime.now().strftime("%Y%m%d%H%M%S")
-    password     = b64encode(f"{SHORTCODE}{PASSKEY}{timestamp}".encode()).decode()
+    # The amount is the order's own total, never a client-supplied figure
+    order = await db.get(Order, order_id)
+    if order is None:
+        raise HTTPException(404, "Order not found")
+    if order.status.lower() != ORDER_PENDING_STATUS:
+        raise HTTPException(409, f"Order is {order.status}, not awaiting payment")
+    # Daraja only accepts whole shillings; round up so the payment covers the total
+    amount = math.ceil(order.total_amount)
+
+    password, timestamp = stk_password()
 
     payload = {
         "BusinessShortCode": SHORTCODE,
@@ -51,19 +172,14 @@ async def send_stk_push(phone_number: str, amount: float, order_id: int, db: Asy
         "TransactionDesc": "Order Payment",
     }
 
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-
-    url = f"{MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest"
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, json=payload, headers=headers)
+    response = await get_daraja_client().post("/mpesa/stkpush/v1/processrequest", payload)
 
     if response.status_code != 200:
+        MPESA_STK_PUSHES.inc(f"http_{response.status_code}")
         raise HTTPException(500, "STK Push request failed")
 
     response_data = response.json()
+    MPESA_STK_PUSHES.inc(response_data.get("ResponseCode", "unknown"))
 
     # Save payment as PENDING in the database
     payment = Payment(
@@ -82,3 +198,15 @@ async def send_stk_push(phone_number: str, amount: float, order_id: int, db: Asy
     await db.commit()
 
     return response_data
+
+
+async def query_stk_push(checkout_request_id: str) -> httpx.Response:
+    """Ask Daraja for the outcome of an STK push (the STK Query API)."""
+    password, timestamp = stk_password()
+    payload = {
+        "BusinessShortCode": SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+    return await get_daraja_client().post("/mpesa/stkpushquery/v1/query", payload)
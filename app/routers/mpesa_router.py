@@ -1,12 +1,15 @@
-import json, logging
-from datetime import datetime
-from fastapi import APIRouter, Depends, Request, HTTPException
-from sqlalchemy import select
+import logging
+from fastapi import APIRouter, Depends, Query, Request, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.auth.auth import get_current_user
 from app.database.connection import get_db
 from app.routers.mpesa_auth import send_stk_push
-from app.models.models import Payment
+from app.payments.callback_queue import callback_processor
+from app.payments.payments import (
+    log_stk_callback, process_logged_callback, replay_unprocessed_callbacks,
+)
+from app.models.models import User
 
 router = APIRouter(prefix="/payments", tags=["Payments"])
 log    = logging.getLogger(__name__)
@@ -14,17 +17,18 @@ log    = logging.getLogger(__name__)
 @router.post("/stk-push")
 async def initiate_payment(
     phone: str,
-    amount: float,
     order_id: int,
     db: AsyncSession = Depends(get_db),   # ✅ real session now
 ):
     try:
-        resp = await send_stk_push(phone, amount, order_id, db)
+        resp = await send_stk_push(phone, order_id, db)
         return {
             "message": "STK push sent; await callback",
             "merchant_request_id": resp.get("MerchantRequestID"),
             "checkout_request_id": resp.get("CheckoutRequestID"),
         }
+    except HTTPException:
+        raise
     except Exception as err:
         log.error("STK push initiation error", exc_info=True)
         raise HTTPException(500, f"Failed to initiate STK push: {err}")
@@ -34,42 +38,47 @@ async def initiate_payment(
 
 @router.post("/callback")
 async def mpesa_callback(request: Request, db: AsyncSession = Depends(get_db)):
-    try:
-        raw = await request.body()
-        if not raw:
-            raise HTTPException(400, "Empty callback body")
-
-        data = json.loads(raw.decode())
-        log.info("🔁 Raw Callback JSON: %s", data)
+    raw = await request.body()
+    if not raw:
+        raise HTTPException(400, "Empty callback body")
+    log.info("🔁 Raw Callback: %s", raw[:2000])
 
-        cb = data["Body"]["stkCallback"]
-        cid = cb["CheckoutRequestID"]
+    # Only the durable copy happens inline: Daraja gets its ack as soon as the
+    # row is committed, and the consumer pool (or the sweep) applies it.
+    log_id = await log_stk_callback(db, raw.decode(errors="replace"))
+    if not callback_processor.running:
+        await process_logged_callback(db, log_id)
+    else:
+        callback_processor.submit(log_id)
+    return {"ResultCode": 0, "ResultDesc": "Accepted"}
 
-    except json.JSONDecodeError as e:
-        log.error("❌ Callback JSON error: %s", e)
-        raise HTTPException(400, "Invalid JSON in callback payload")
-    except KeyError:
-        raise HTTPException(400, "Malformed callback payload")
 
-    # Find payment
-    q = await db.execute(select(Payment).filter_by(checkout_request_id=cid))
-    pay = q.scalars().first()
-    if not pay:
-        return {"message": "Payment not found"}
+# --- Admin: re-run logged callbacks (idempotent) ---
+def _require_admin(current_user: User) -> None:
+    if current_user.role.upper() != "ADMIN":
+        raise HTTPException(403, "Only admins can replay callbacks")
 
-    # Update payment
-    if cb["ResultCode"] == 0:
-     meta = {i["Name"]: i.get("Value") for i in cb["CallbackMetadata"]["Item"]}
-     pay.status = "COMPLETED"
-     pay.mpesa_receipt_number = meta.get("MpesaReceiptNumber")
-     pay.amount = meta.get("Amount")
-     pay.phone_number = str(meta.get("PhoneNumber"))  # 👈 Fix here
-     pay.transaction_date = datetime.utcnow()
-    else:
-     pay.status = "FAILED"
 
+@router.post("/callbacks/{log_id}/replay")
+async def replay_callback(
+    log_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    _require_admin(current_user)
+    try:
+        outcome = await process_logged_callback(db, log_id)
+    except LookupError:
+        raise HTTPException(404, "Callback log entry not found")
+    return {"log_id": log_id, "outcome": outcome.outcome, "status": outcome.status}
 
-    pay.updated_at = datetime.utcnow()
-    await db.commit()
 
-    return {"message": "Callback processed", "status": pay.status}
+@router.post("/callbacks/replay-unprocessed")
+async def replay_unprocessed(
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    _require_admin(current_user)
+    outcomes = await replay_unprocessed_callbacks(db, limit)
+    return {"replayed": len(outcomes), "outcomes": [o.outcome for o in outcomes]}
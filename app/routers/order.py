@@ -1,15 +1,19 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 import os
 
-from app.models.models import Order, OrderItem, User, Product
-from app.schemas.schema import OrderCreate, OrderUpdate, OrderOut
-from app.auth.auth import get_db, get_current_user
-from app.EMail.email_service import send_email
-from app.EMail.email_templates import generate_order_email_body
+from app.models.models import Order, OrderItem, Product, User
+from app.schemas.schema import OrderCreate, OrderUpdate, OrderOut, Principal
+from app.auth.auth import get_db, get_current_principal, get_current_user
+from app.inventory.inventory import CANCELLED_STATUS, aggregate_quantities, cancel_order, reserve_stock
+from app.utils.cache import invalidate_products
+from app.utils.pagination import paginate, set_next_cursor
+from app.EMail.outbox import email_worker, enqueue_email
+from app.EMail.email_templates import render_order_email
 
 router = APIRouter()
 
@@ -122,73 +126,96 @@ product_loader = (
 )
 async def create_order(
     order: OrderCreate,
-    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
-    # 1. Create order and items
+    # 1. Load every ordered product in one round trip; this single load also
+    #    feeds the email details and the response body below.
+    product_ids = {i.product_id for i in order.order_items}
+    res = await db.execute(
+        select(Product)
+        .options(
+            selectinload(Product.category),
+            selectinload(Product.images),
+            selectinload(Product.videos),
+        )
+        .where(Product.id.in_(product_ids))
+    )
+    products = {p.id: p for p in res.scalars().all()}
+
+    missing = sorted(product_ids - products.keys())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Products not found: {missing}")
+
+    admin_email = os.getenv("ADMIN_EMAIL")
+    if not admin_email:
+        raise HTTPException(status_code=500, detail="ADMIN_EMAIL not configured")
+
+    # 2. Reserve stock atomically (409 if any line is short)
+    reserved = await reserve_stock(db, aggregate_quantities(order.order_items))
+    for product_id, stock in reserved.items():
+        set_committed_value(products[product_id], "stock", stock)
+
+    # 3. Create order and items, priced from the catalogue (client prices
+    #    and totals are ignored)
+    order_items_entities = []
+    for i in order.order_items:
+        product = products[i.product_id]
+        oi = OrderItem(product_id=i.product_id, quantity=i.quantity, price=product.price)
+        # Attach the already-loaded product without touching Product.order_items
+        set_committed_value(oi, "product", product)
+        order_items_entities.append(oi)
+
     new_order = Order(
         user_id=current_user.id,
         customer_name=order.customer_name,
         customer_email=order.customer_email,
         customer_phone=order.customer_phone,
-        total_amount=order.total_amount,
+        total_amount=round(sum(oi.price * oi.quantity for oi in order_items_entities), 2),
         shipping_address=order.shipping_address,
         status="pending",
     )
-    order_items_entities = [
-        OrderItem(product_id=i.product_id, quantity=i.quantity, price=i.price)
-        for i in order.order_items
-    ]
     new_order.order_items = order_items_entities
 
     db.add(new_order)
     await db.flush()
 
-    # 2. Fetch product images and build item details
-    item_details: List[dict] = []
-    for oi in order_items_entities:
-        res = await db.execute(
-            select(Product).options(selectinload(Product.images)).where(Product.id == oi.product_id)
-        )
-        product = res.scalar_one()
-        image_url = product.images[0].url if product.images else ""
-        item_details.append(
-            {
-                "name": product.name,
-                "quantity": oi.quantity,
-                "price": oi.price,
-                "image_url": image_url,
-            }
-        )
-
-    await db.commit()
-    await db.refresh(new_order)
-
-    # 3. Send email to both admin and customer
-    admin_email = os.getenv("ADMIN_EMAIL")
-    if not admin_email:
-        raise HTTPException(status_code=500, detail="ADMIN_EMAIL not configured")
+    # 4. Build the response and email details from the in-memory graph
+    #    before commit expires it, so no reload query is needed.
+    created = OrderOut.model_validate(new_order, from_attributes=True)
+    item_details: List[dict] = [
+        {
+            "name": oi.product.name,
+            "quantity": oi.quantity,
+            "price": oi.price,
+            "image_url": oi.product.images[0].url if oi.product.images else "",
+        }
+        for oi in order_items_entities
+    ]
 
-    email_body = generate_order_email_body(
-        customer_name=new_order.customer_name,
-        email=new_order.customer_email,
-        phone=new_order.customer_phone,
-        shipping=new_order.shipping_address,
-        total=new_order.total_amount,
+    # 5. Queue the email to admin and customer in the same transaction, so
+    #    it survives restarts and is only sent if the order is committed
+    body_html, body_text = render_order_email(
+        customer_name=created.customer_name,
+        email=created.customer_email,
+        phone=created.customer_phone,
+        shipping=created.shipping_address,
+        total=created.total_amount,
         items=item_details,
     )
 
-    recipients = [admin_email, new_order.customer_email]
-    subject = f"Order #{new_order.id} from {new_order.customer_name}"
+    recipients = [admin_email, created.customer_email]
+    subject = f"Order #{created.id} from {created.customer_name}"
 
-    background_tasks.add_task(send_email, subject, recipients, email_body)
+    enqueue_email(db, subject, recipients, body_html, body_text)
 
-    # 4. Return created order
-    res = await db.execute(
-        select(Order).options(product_loader).where(Order.id == new_order.id)
-    )
-    return res.scalar_one()
+    await db.commit()
+    email_worker.wake()
+    # Stock changed, so cached catalogue responses are stale
+    await invalidate_products(*reserved)
+
+    # 6. Return created order
+    return created
 
 
 # --------------------------------------------------------------------------- #
@@ -196,35 +223,42 @@ async def create_order(
 # --------------------------------------------------------------------------- #
 @router.get("/orders", response_model=List[OrderOut], summary="Get all orders")
 async def get_orders(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     query = select(Order).options(product_loader)
     if current_user.role.upper() != "ADMIN":
         query = query.where(Order.user_id == current_user.id)
-    res = await db.execute(query.offset(skip).limit(limit))
-    return res.scalars().all()
+    res = await db.execute(paginate(query, Order.id, skip, limit, cursor))
+    orders = res.scalars().all()
+    set_next_cursor(response, orders, limit)
+    return orders
 
 # --------------------------------------------------------------------------- #
 #                           GET MY ORDERS                                     #
 # --------------------------------------------------------------------------- #
 @router.get("/orders/me", response_model=List[OrderOut], summary="Get my orders")
 async def get_my_orders(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
-    res = await db.execute(
+    query = (
         select(Order)
         .options(product_loader)
         .where(Order.user_id == current_user.id)
-        .offset(skip)
-        .limit(limit)
     )
-    return res.scalars().all()
+    res = await db.execute(paginate(query, Order.id, skip, limit, cursor))
+    orders = res.scalars().all()
+    set_next_cursor(response, orders, limit)
+    return orders
 
 # --------------------------------------------------------------------------- #
 #                        GET ORDER BY ID                                      #
@@ -264,10 +298,36 @@ async def update_order(
     if current_user.role.upper() != "ADMIN" and order_obj.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    for field, val in updated.dict(exclude_unset=True).items():
+    changes = updated.dict(exclude_unset=True)
+    if "total_amount" in changes and current_user.role.upper() != "ADMIN":
+        raise HTTPException(status_code=403, detail="Only admins can change order totals")
+    new_status = changes.pop("status", None)
+    restocked: List[int] = []
+    if new_status is not None and order_obj.status != new_status:
+        if order_obj.status == CANCELLED_STATUS:
+            raise HTTPException(status_code=400, detail="Cancelled orders cannot be reopened")
+        # Payment and fulfilment are recorded by _mark_order_paid and admins;
+        # a customer can only cancel
+        if new_status.lower() != CANCELLED_STATUS and current_user.role.upper() != "ADMIN":
+            raise HTTPException(status_code=403, detail="Customers can only cancel an order")
+        if new_status.lower() == CANCELLED_STATUS:
+            restocked = await cancel_order(db, order_id)
+            if restocked is None:
+                # Paid or fulfilled: the goods are sold, so never restock. Only
+                # an admin may cancel it (and handles any refund by hand).
+                if current_user.role.upper() != "ADMIN":
+                    raise HTTPException(status_code=409, detail="Only pending orders can be cancelled")
+                order_obj.status = CANCELLED_STATUS
+                restocked = []
+        else:
+            order_obj.status = new_status
+
+    for field, val in changes.items():
         setattr(order_obj, field, val)
 
     await db.commit()
+    if restocked:
+        await invalidate_products(*restocked)
     await db.refresh(order_obj)
 
     res = await db.execute(
@@ -291,5 +351,16 @@ async def delete_order(
     if current_user.role.upper() != "ADMIN" and order_obj.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
+    # Release the stock a pending order still holds. Paid or fulfilled orders
+    # keep their stock taken; only an admin may delete those records.
+    restocked = await cancel_order(db, order_id)
+    if (
+        restocked is None
+        and order_obj.status != CANCELLED_STATUS
+        and current_user.role.upper() != "ADMIN"
+    ):
+        raise HTTPException(status_code=409, detail="Only pending or cancelled orders can be deleted")
     await db.delete(order_obj)
     await db.commit()
+    if restocked:
+        await invalidate_products(*restocked)
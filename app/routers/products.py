@@ -3,19 +3,73 @@
 
 
 
+from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from pydantic import TypeAdapter
 from sqlalchemy import delete, select
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models.models import Product, ProductImage, ProductVideo, User
-from app.schemas.schema import ProductCreate, ProductUpdate, ProductOut
+from app.models.models import Category, Product, ProductImage, ProductVideo, User
+from app.schemas.schema import ProductCreate, ProductUpdate, ProductOut, SuggestionOut
 from app.auth.auth import get_db, get_current_user
+from app.utils.cache import (
+    PRODUCT_LIST_TAG, CachedResponse, category_tag, invalidate_products, product_tag,
+    response_cache,
+)
+from app.utils.http_cache import is_not_modified, not_modified_response, validator_headers
+from app.utils.pagination import NEXT_CURSOR_HEADER, decode_cursor, next_cursor, paginate
+from app.search.search import search_backend
+from app.search.suggest import product_thumbnail, suggest_index
 
 router = APIRouter()
 
+# Many-to-one category is joined; images/videos are fetched with one extra
+# IN query each, so rows never multiply into an images x videos product.
+product_loader = (
+    joinedload(Product.category),
+    selectinload(Product.images),
+    selectinload(Product.videos),
+)
+
+
+async def _load_products(db: AsyncSession, ids: List[int]) -> List[Product]:
+    """Load products with relations, preserving the order of ``ids``."""
+    if not ids:
+        return []
+    result = await db.execute(
+        select(Product).options(*product_loader).where(Product.id.in_(ids))
+    )
+    by_id = {p.id: p for p in result.scalars().all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+_product_out = TypeAdapter(ProductOut)
+_product_list_out = TypeAdapter(List[ProductOut])
+
+
+def _newest(rows) -> Optional[datetime]:
+    """Latest product/category ``updated_at`` across (id, product_ts, category_ts) rows."""
+    stamps = [ts for row in rows for ts in row[1:] if ts is not None]
+    return max(stamps) if stamps else None
+
+
+def _ranked_page(rows, skip: int, limit: int, cursor: Optional[str]):
+    """Slice a relevance-ordered result; the cursor resumes after its product id."""
+    start = skip
+    if cursor:
+        last_id = decode_cursor(cursor)
+        start = next((i + 1 for i, row in enumerate(rows) if row[0] == last_id), len(rows))
+    return rows[start:start + limit]
+
+
+def _cached_response(request: Request, cached: CachedResponse) -> Response:
+    if is_not_modified(request, cached.headers):
+        return not_modified_response(cached.headers)
+    return response_cache.to_response(cached, hit=True)
+
 # ────────────────────────────────────────────────────────────────
 # CREATE PRODUCT
 # ────────────────────────────────────────────────────────────────
@@ -48,18 +102,19 @@ async def create_product(
 
     await db.commit()
     await db.refresh(new_product)
+    search_backend.index_product(new_product)
+    suggest_index.add_product(
+        new_product.id, new_product.name, new_product.image_url or next(iter(image_urls), None)
+    )
+    await invalidate_products()
 
     # 3) Return product with eager‑loaded relations
     result = await db.execute(
         select(Product)
-        .options(
-            joinedload(Product.category),
-            joinedload(Product.images),
-            joinedload(Product.videos),
-        )
+        .options(*product_loader)
         .where(Product.id == new_product.id)
     )
-    return result.unique().scalar_one()
+    return result.scalar_one()
 
 
 # ────────────────────────────────────────────────────────────────
@@ -67,30 +122,65 @@ async def create_product(
 # ────────────────────────────────────────────────────────────────
 @router.get("/", response_model=List[ProductOut], summary="Get all products")
 async def get_products(
+    request: Request,
     name: Optional[str] = Query(None),
     category: Optional[str] = Query(None),
     skip: int = Query(0, ge=0),
     limit: int = Query(2, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header"),
     db: AsyncSession = Depends(get_db),
 ):
-    query = (
-        select(Product)
-        .options(
-            joinedload(Product.category),
-            joinedload(Product.images),
-            joinedload(Product.videos),
-        )
-        .offset(skip)
-        .limit(limit)
+    cached = await response_cache.get(request)
+    if cached is not None:
+        return _cached_response(request, cached)
+
+    # Phase 1: page over bare product ids, so LIMIT applies to products and
+    # not to joined image/video rows. The timestamps feed the ETag.
+    query = select(Product.id, Product.updated_at, Category.updated_at).outerjoin(
+        Category, Product.category_id == Category.id
     )
+    if category:
+        query = query.where(Category.name == category)
 
     if name:
-        query = query.where(Product.name.ilike(f"%{name}%"))
-    if category:
-        query = query.join(Product.category).where(Product.category.has(name=category))
+        # Search results come back in relevance order, not id order
+        ranked = await search_backend.search(db, name)
+        rows = (await db.execute(query.where(Product.id.in_(ranked)))).all()
+        position = {product_id: i for i, product_id in enumerate(ranked)}
+        rows.sort(key=lambda row: position[row[0]])
+        page = _ranked_page(rows, skip, limit, cursor)
+    else:
+        page = (await db.execute(paginate(query, Product.id, skip, limit, cursor))).all()
+    page_ids = [row[0] for row in page]
+
+    headers = validator_headers(len(page), _newest(page), page_ids)
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+
+    # Phase 2: load just that page with its collections
+    products = await _load_products(db, page_ids)
+
+    # Serialize once and cache the bytes; hits skip the DB and Pydantic.
+    body = _product_list_out.dump_json(
+        _product_list_out.validate_python(products, from_attributes=True)
+    )
+    cursor_value = next_cursor(products, limit)
+    if cursor_value:
+        headers[NEXT_CURSOR_HEADER] = cursor_value
+    cached = await response_cache.set(request, body, [PRODUCT_LIST_TAG], headers)
+    return response_cache.to_response(cached, hit=False)
 
-    result = await db.execute(query)
-    return result.unique().scalars().all()
+
+# ────────────────────────────────────────────────────────────────
+# SEARCH SUGGESTIONS (declared before /{product_id})
+# ────────────────────────────────────────────────────────────────
+@router.get("/suggest", response_model=List[SuggestionOut], summary="Autocomplete product and category names")
+async def suggest(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(8, ge=1, le=20),
+):
+    # Served from the in-process prefix index: no DB session, no eager loads
+    return suggest_index.suggest(q, limit)
 
 
 # ────────────────────────────────────────────────────────────────
@@ -99,22 +189,42 @@ async def get_products(
 @router.get("/{product_id}", response_model=ProductOut, summary="Get product by ID")
 async def get_product(
     product_id: int,
+    request: Request,
     db: AsyncSession = Depends(get_db),
     # current_user: User = Depends(get_current_user),
 ):
+    cached = await response_cache.get(request)
+    if cached is not None:
+        return _cached_response(request, cached)
+
+    # Cheap timestamp probe first so revalidations never load relations
+    stamp = (
+        await db.execute(
+            select(Product.id, Product.updated_at, Category.updated_at)
+            .outerjoin(Category, Product.category_id == Category.id)
+            .where(Product.id == product_id)
+        )
+    ).first()
+    if stamp is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    headers = validator_headers(1, _newest([stamp]), [product_id])
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+
     result = await db.execute(
         select(Product)
-        .options(
-            joinedload(Product.category),
-            joinedload(Product.images),
-            joinedload(Product.videos),
-        )
+        .options(*product_loader)
         .where(Product.id == product_id)
     )
-    product = result.unique().scalar_one_or_none()
+    product = result.scalar_one_or_none()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+
+    body = _product_out.dump_json(_product_out.validate_python(product, from_attributes=True))
+    tags = [product_tag(product.id), category_tag(product.category_id)]
+    cached = await response_cache.set(request, body, tags, headers)
+    return response_cache.to_response(cached, hit=False)
 
 
 # ────────────────────────────────────────────────────────────────
@@ -138,6 +248,8 @@ async def update_product(
     # 1) Update scalar fields
     for field, value in payload.dict(exclude_unset=True, exclude={"image_urls", "video_urls"}).items():
         setattr(product, field, value)
+    # Bump explicitly: media-only edits would otherwise leave the ETag unchanged
+    product.updated_at = datetime.utcnow()
 
     # 2) Replace images if provided
     if payload.image_urls is not None:
@@ -154,18 +266,18 @@ async def update_product(
         )
 
     await db.commit()
+    await invalidate_products(product_id)
 
     # 4) Return updated product with relations
     result = await db.execute(
         select(Product)
-        .options(
-            joinedload(Product.category),
-            joinedload(Product.images),
-            joinedload(Product.videos),
-        )
+        .options(*product_loader)
         .where(Product.id == product_id)
     )
-    return result.unique().scalar_one()
+    product = result.scalar_one()
+    search_backend.index_product(product)
+    suggest_index.add_product(product.id, product.name, product_thumbnail(product))
+    return product
 
 
 # ────────────────────────────────────────────────────────────────
@@ -188,3 +300,6 @@ async def delete_product(
 
     await db.delete(product)
     await db.commit()
+    search_backend.remove_product(product_id)
+    suggest_index.remove_product(product_id)
+    await invalidate_products(product_id)
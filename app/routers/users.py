@@ -124,8 +124,8 @@
 
 
 
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -137,8 +137,10 @@ from app.schemas.schema import (
 )
 from app.auth.auth import (
     get_db, register_user, login_for_access_token,
-    request_password_reset, reset_password, get_current_user
+    request_password_reset, reset_password, get_current_user,
+    invalidate_cached_user
 )
+from app.utils.pagination import paginate, set_next_cursor
 
 router = APIRouter()
 
@@ -209,6 +211,7 @@ async def update_profile(
         db.add(current_user)
         await db.commit()
         await db.refresh(current_user)
+        invalidate_cached_user(current_user.id)
         return current_user
     except Exception as e:
         raise HTTPException(
@@ -219,6 +222,10 @@ async def update_profile(
 # Get all users (admin only)
 @router.get("/users", response_model=List[UserResponse], summary="Get all users (admin only)")
 async def get_all_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -228,9 +235,12 @@ async def get_all_users(
             detail="Only admins can access this endpoint."
         )
     try:
-        result = await db.execute(select(User))
+        result = await db.execute(paginate(select(User), User.id, skip, limit, cursor))
         users = result.scalars().all()
+        set_next_cursor(response, users, limit)
         return users
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -267,6 +277,7 @@ async def update_user(
         db.add(user)
         await db.commit()
         await db.refresh(user)
+        invalidate_cached_user(user_id)
         return user
     except Exception as e:
         raise HTTPException(
@@ -299,6 +310,7 @@ async def delete_user(
 
         await db.delete(user)
         await db.commit()
+        invalidate_cached_user(user_id)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -212,8 +212,8 @@
 #     quantity: int
 
 
-from pydantic import BaseModel, ConfigDict, EmailStr, HttpUrl
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, HttpUrl, model_validator
+from typing import List, Literal, Optional
 from datetime import date, datetime
 
 # === AUTH ===
@@ -227,6 +227,14 @@ class TokenData(BaseModel):
     id: int
 
 
+class Principal(BaseModel):
+    """Authenticated caller built from the JWT claims alone (no DB lookup)."""
+    id: int
+    email: Optional[str] = None
+    name: Optional[str] = None
+    role: str = "Customer"
+
+
 # === USER ===
 class UserCreate(BaseModel):
     name: str
@@ -349,6 +357,13 @@ class ProductOut(ProductBase):
         orm_mode = True
 
 
+class SuggestionOut(BaseModel):
+    type: str  # "product" or "category"
+    id: int
+    name: str
+    thumbnail: Optional[str] = None
+
+
 # === ORDER ITEM ===
 class OrderItemBase(BaseModel):
     product_id: int
@@ -356,8 +371,10 @@ class OrderItemBase(BaseModel):
     price: float
 
 
-class OrderItemCreate(OrderItemBase):
-    pass
+class OrderItemCreate(BaseModel):
+    product_id: int
+    quantity: int = Field(..., gt=0)
+    price: Optional[float] = None  # ignored, priced from Product.price
 
 
 class OrderItemOut(OrderItemBase):
@@ -379,7 +396,8 @@ class OrderBase(BaseModel):
 
 
 class OrderCreate(OrderBase):
-    order_items: List[OrderItemCreate]
+    total_amount: Optional[float] = None  # ignored, computed server-side
+    order_items: List[OrderItemCreate] = Field(..., min_length=1)
 
 
 class OrderUpdate(BaseModel):
@@ -423,6 +441,29 @@ class CartOut(BaseModel):
         orm_mode = True
 
 
+class CartLineOut(BaseModel):
+    product_id: int
+    name: str
+    thumbnail: Optional[str] = None
+    unit_price: float
+    quantity: int
+    line_total: float
+
+
+class CartCompactOut(BaseModel):
+    id: int
+    user_id: int
+    updated_at: datetime
+    items: List[CartLineOut] = []
+    item_count: int  # sum of quantities
+    subtotal: float
+
+
+class CartSummaryOut(BaseModel):
+    item_count: int
+    subtotal: float
+
+
 class CartItemCreate(BaseModel):
     product_id: int
     quantity: int
@@ -431,3 +472,21 @@ class CartItemCreate(BaseModel):
 class CartItemUpdate(BaseModel):
     product_id: int
     quantity: int
+
+
+class CartItemOperation(BaseModel):
+    op: Literal["add", "set", "remove"]
+    product_id: int
+    quantity: Optional[int] = Field(None, ge=0)  # required for add (> 0) and set (0 removes)
+
+    @model_validator(mode="after")
+    def _check_quantity(self):
+        if self.op == "add" and not self.quantity:
+            raise ValueError("add needs a quantity greater than 0")
+        if self.op == "set" and self.quantity is None:
+            raise ValueError("set needs a quantity")
+        return self
+
+
+class CartBatchUpdate(BaseModel):
+    operations: List[CartItemOperation] = Field(..., min_length=1, max_length=100)
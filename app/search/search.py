@@ -0,0 +1,212 @@
+import bisect
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.connection import engine
+from app.models.models import Product
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")  # auto | postgres | memory
+# Upper bound on ranked ids fetched per query; pages are cut from this list
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 1000))
+# Minimum similarity for the typo fallback in the in-memory backend; Postgres
+# uses pg_trgm.word_similarity_threshold, which defaults to the same 0.6
+SEARCH_TRIGRAM_THRESHOLD = float(os.getenv("SEARCH_TRIGRAM_THRESHOLD", 0.6))
+
+# Must match the text search config used by the products.search_vector migration
+SEARCH_CONFIG = "english"
+
+# Generated column maintained by Postgres; deliberately not mapped on the
+# model so SQLite/create_all never sees a tsvector type.
+search_vector = literal_column("products.search_vector", type_=TSVECTOR)
+# Inlined as a regconfig literal rather than bound as a text parameter
+_search_config = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+def _prefix_tsquery(tokens: List[str]) -> str:
+    # "red ch" -> "red & ch:*", so results show up while the last word is typed
+    return " & ".join(tokens[:-1] + [tokens[-1] + ":*"])
+
+
+class PostgresSearchBackend:
+    """Ranked full-text search over the ``products.search_vector`` GIN index.
+
+    Name, colors and description are weighted A/B/C in the vector. When the
+    full-text query matches nothing, a pg_trgm similarity match on the name
+    catches typos. The column is generated, so writes need no extra work.
+    """
+
+    async def search(self, db: AsyncSession, text: str, limit: int = SEARCH_MAX_RESULTS) -> List[int]:
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+
+        query = func.to_tsquery(_search_config, _prefix_tsquery(tokens))
+        result = await db.execute(
+            select(Product.id)
+            .where(search_vector.op("@@")(query))
+            .order_by(func.ts_rank_cd(search_vector, query).desc(), Product.id)
+            .limit(limit)
+        )
+        ids = list(result.scalars().all())
+        if ids:
+            return ids
+
+        # Typo fallback: "name %> text" (word similarity) is served by the
+        # gin_trgm_ops index
+        result = await db.execute(
+            select(Product.id)
+            .where(Product.name.op("%>")(text))
+            .order_by(func.word_similarity(text, Product.name).desc(), Product.id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def rebuild(self, db: AsyncSession) -> None:
+        pass
+
+    def index_product(self, product) -> None:
+        pass
+
+    def remove_product(self, product_id: int) -> None:
+        pass
+
+
+def _trigrams(text: str) -> Set[str]:
+    # pg_trgm style: each word padded with two leading and one trailing space
+    grams: Set[str] = set()
+    for word in tokenize(text):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def word_similarity(query: str, text: str) -> float:
+    """Share of the query's trigrams found in ``text``.
+
+    Like pg_trgm's ``word_similarity``, without the contiguous-extent rule.
+    """
+    wanted = _trigrams(query)
+    if not wanted:
+        return 0.0
+    return len(wanted & _trigrams(text)) / len(wanted)
+
+
+class InMemorySearchBackend:
+    """Per-process inverted index for SQLite and tests.
+
+    Mirrors the Postgres backend: every query word must match (the last one
+    as a prefix), scores use the same field weights as ``ts_rank``, and a
+    trigram similarity on names is the fallback. Words are not stemmed.
+    The index is built at startup and kept current by the product routes,
+    so it is only exact for a single worker.
+    """
+
+    FIELD_WEIGHTS = {"name": 1.0, "colors": 0.4, "description": 0.2}
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._vocab: List[str] = []  # sorted keys of _postings, for prefix lookups
+        self._doc_terms: Dict[int, Set[str]] = {}
+        self._names: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def index_product(self, product) -> None:
+        self.remove_product(product.id)
+        terms: Set[str] = set()
+        for field, weight in self.FIELD_WEIGHTS.items():
+            for token in tokenize(getattr(product, field, None)):
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    bisect.insort(self._vocab, token)
+                postings[product.id] = postings.get(product.id, 0.0) + weight
+                terms.add(token)
+        self._doc_terms[product.id] = terms
+        self._names[product.id] = product.name or ""
+
+    def remove_product(self, product_id: int) -> None:
+        for token in self._doc_terms.pop(product_id, ()):
+            postings = self._postings[token]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                del self._vocab[bisect.bisect_left(self._vocab, token)]
+        self._names.pop(product_id, None)
+
+    def _prefix_terms(self, prefix: str) -> Iterable[str]:
+        start = bisect.bisect_left(self._vocab, prefix)
+        for term in self._vocab[start:]:
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def _match(self, token: str, prefix: bool) -> Dict[int, float]:
+        if not prefix:
+            return self._postings.get(token, {})
+        scores: Dict[int, float] = {}
+        for term in self._prefix_terms(token):
+            for product_id, weight in self._postings[term].items():
+                scores[product_id] = max(scores.get(product_id, 0.0), weight)
+        return scores
+
+    async def search(self, db: AsyncSession, text: str, limit: int = SEARCH_MAX_RESULTS) -> List[int]:
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+
+        scores: Optional[Dict[int, float]] = None
+        for i, token in enumerate(tokens):
+            matches = self._match(token, prefix=i == len(tokens) - 1)
+            if scores is None:
+                scores = dict(matches)
+            else:
+                scores = {pid: s + matches[pid] for pid, s in scores.items() if pid in matches}
+            if not scores:
+                break
+
+        if not scores:
+            scores = {}
+            for product_id, name in self._names.items():
+                similarity = word_similarity(text, name)
+                if similarity >= SEARCH_TRIGRAM_THRESHOLD:
+                    scores[product_id] = similarity
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [product_id for product_id, _ in ranked[:limit]]
+
+    async def rebuild(self, db: AsyncSession) -> None:
+        self._postings.clear()
+        self._vocab.clear()
+        self._doc_terms.clear()
+        self._names.clear()
+        result = await db.stream(
+            select(Product.id, Product.name, Product.colors, Product.description)
+            .execution_options(yield_per=500)
+        )
+        async for row in result:
+            self.index_product(row)
+
+
+def _backend_from_settings():
+    backend = SEARCH_BACKEND
+    if backend == "auto":
+        backend = "postgres" if engine.dialect.name == "postgresql" else "memory"
+    if backend == "postgres":
+        return PostgresSearchBackend()
+    return InMemorySearchBackend()
+
+
+search_backend = _backend_from_settings()
@@ -0,0 +1,133 @@
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import Category, Product, ProductImage
+from app.search.search import tokenize
+
+PRODUCT = "product"
+CATEGORY = "category"
+
+# (kind, id) identifies one suggestion
+_Ref = Tuple[str, int]
+
+
+class SuggestIndex:
+    """In-process prefix index over product and category names.
+
+    Every word start of a name is a key ("red velvet chair", "velvet chair",
+    "chair"). Keys live in two sorted lists, whole names and inner words, so
+    a lookup is a bisect plus a scan that stops after ``limit`` hits and
+    name-start matches come first. Entries carry a ready-to-send dict, so
+    serving a suggestion never touches the database. Built at startup; the
+    product and category routes keep it current for their own worker.
+    """
+
+    def __init__(self):
+        # (key, kind, id); [0] holds whole names, [1] inner-word suffixes
+        self._keys: Tuple[List[Tuple[str, str, int]], ...] = ([], [])
+        self._entries: Dict[_Ref, dict] = {}
+
+    @staticmethod
+    def _keys_for(kind: str, item_id: int, name: Optional[str]):
+        words = tokenize(name)
+        for position in range(len(words)):
+            yield min(position, 1), (" ".join(words[position:]), kind, item_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _add(self, kind: str, item_id: int, name: Optional[str], thumbnail: Optional[str] = None) -> None:
+        self._remove(kind, item_id)
+        if not tokenize(name):
+            return
+        self._entries[(kind, item_id)] = {
+            "type": kind, "id": item_id, "name": name, "thumbnail": thumbnail,
+        }
+        for bucket, key in self._keys_for(kind, item_id, name):
+            bisect.insort(self._keys[bucket], key)
+
+    def _remove(self, kind: str, item_id: int) -> None:
+        entry = self._entries.pop((kind, item_id), None)
+        if entry is None:
+            return
+        for bucket, key in self._keys_for(kind, item_id, entry["name"]):
+            keys = self._keys[bucket]
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def add_product(self, product_id: int, name: Optional[str], thumbnail: Optional[str]) -> None:
+        self._add(PRODUCT, product_id, name, thumbnail)
+
+    def remove_product(self, product_id: int) -> None:
+        self._remove(PRODUCT, product_id)
+
+    def add_category(self, category_id: int, name: Optional[str]) -> None:
+        self._add(CATEGORY, category_id, name)
+
+    def remove_category(self, category_id: int) -> None:
+        self._remove(CATEGORY, category_id)
+
+    def suggest(self, text: str, limit: int = 8) -> List[dict]:
+        prefix = " ".join(tokenize(text))
+        if not prefix:
+            return []
+
+        # Dict keeps insertion order: name-start matches first, then inner words
+        matches: Dict[_Ref, None] = {}
+        for keys in self._keys:
+            i = bisect.bisect_left(keys, (prefix,))
+            while i < len(keys) and len(matches) < limit:
+                key, kind, item_id = keys[i]
+                if not key.startswith(prefix):
+                    break
+                matches[(kind, item_id)] = None
+                i += 1
+        return [self._entries[ref] for ref in matches]
+
+    async def rebuild(self, db: AsyncSession) -> None:
+        products = await db.execute(select(Product.id, Product.name, thumbnail_column()))
+        categories = await db.execute(select(Category.id, Category.name))
+
+        # Built aside and swapped in, so lookups never see a half-filled index
+        entries: Dict[_Ref, dict] = {}
+        keys = ([], [])
+        for kind, rows in ((PRODUCT, products), (CATEGORY, categories)):
+            for row in rows:
+                item_id, name, thumbnail = row[0], row[1], row[2] if kind == PRODUCT else None
+                if not tokenize(name):
+                    continue
+                entries[(kind, item_id)] = {
+                    "type": kind, "id": item_id, "name": name, "thumbnail": thumbnail,
+                }
+                for bucket, key in self._keys_for(kind, item_id, name):
+                    keys[bucket].append(key)
+        # One sort per list instead of an insort per key
+        for bucket in keys:
+            bucket.sort()
+        self._entries, self._keys = entries, keys
+
+
+def thumbnail_column():
+    """SQL twin of ``product_thumbnail``: image_url, else the product's first gallery image."""
+    first_image = (
+        select(ProductImage.url)
+        .where(ProductImage.product_id == Product.id)
+        .order_by(ProductImage.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return func.coalesce(Product.image_url, first_image)
+
+
+def product_thumbnail(product) -> Optional[str]:
+    """Primary image_url, else the first gallery image of a product with images loaded."""
+    if product.image_url:
+        return product.image_url
+    return product.images[0].url if product.images else None
+
+
+suggest_index = SuggestIndex()
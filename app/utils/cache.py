@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+
+log = logging.getLogger(__name__)
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory | redis | none
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    headers: Dict[str, str]
+
+
+class InMemoryCacheBackend:
+    """Per-process LRU with TTL and a tag -> keys index for invalidation."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, CachedResponse, Tuple[str, ...]]]" = OrderedDict()
+        self._tags: Dict[str, Set[str]] = {}
+        self._generations: Dict[str, int] = {}
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: CachedResponse, ttl: float, tags: Iterable[str]) -> None:
+        self._drop(key)
+        tags = tuple(tags)
+        self._entries[key] = (time.monotonic() + ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+
+    async def generation(self, tag: str) -> int:
+        return self._generations.get(tag, 0)
+
+
+# Add a key to a tag set and make the set live at least as long as the key.
+# PEXPIRE alone would let a short-lived entry cut the TTL of a set that still
+# lists longer-lived ones, which then escape invalidation.
+_TAG_ADD_SCRIPT = """
+redis.call('SADD', KEYS[1], ARGV[1])
+-- PTTL is -1 for a set SADD just created
+if redis.call('PTTL', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+"""
+
+
+class RedisCacheBackend:
+    """Shared backend for multi-worker deployments (any Redis-compatible server).
+
+    Needs the optional ``redis`` package.
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = "respcache:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis requires the 'redis' package") from e
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+        self._tag_add = self._redis.register_script(_TAG_ADD_SCRIPT)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        raw = await self._redis.get(self._prefix + key)
+        if raw is None:
+            return None
+        headers, _, body = raw.partition(b"\n")
+        return CachedResponse(body, json.loads(headers))
+
+    async def set(self, key: str, value: CachedResponse, ttl: float, tags: Iterable[str]) -> None:
+        ttl_ms = max(int(ttl * 1000), 1)
+        raw = json.dumps(value.headers).encode() + b"\n" + value.body
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(self._prefix + key, raw, px=ttl_ms)
+            for tag in tags:
+                await self._tag_add(keys=[f"{self._prefix}tag:{tag}"], args=[key, ttl_ms], client=pipe)
+            await pipe.execute()
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            await self._redis.incr(f"{self._prefix}gen:{tag}")
+            tag_key = f"{self._prefix}tag:{tag}"
+            keys = await self._redis.smembers(tag_key)
+            await self._redis.delete(tag_key, *[self._prefix + k.decode() for k in keys])
+
+    async def generation(self, tag: str) -> int:
+        return int(await self._redis.get(f"{self._prefix}gen:{tag}") or 0)
+
+
+class ResponseCache:
+    """Read-through cache of pre-serialized JSON responses.
+
+    Entries are keyed on the request path plus its sorted query string and
+    carry tags (e.g. ``products``, ``product:12``) so writes can drop exactly
+    the responses they affect. Backend errors are logged and treated as misses.
+    """
+
+    def __init__(self, backend, ttl: float = RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(request: Request) -> str:
+        query = urlencode(sorted(request.query_params.multi_items()))
+        return f"{request.url.path}?{query}"
+
+    async def get(self, request: Request) -> Optional[CachedResponse]:
+        if self.backend is None:
+            return None
+        try:
+            cached = await self.backend.get(self.key_for(request))
+        except Exception:
+            log.warning("Response cache read failed", exc_info=True)
+            cached = None
+        if cached is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cached
+
+    async def set(
+        self,
+        request: Request,
+        body: bytes,
+        tags: Iterable[str],
+        headers: Optional[Dict[str, str]] = None,
+        ttl: Optional[float] = None,
+    ) -> CachedResponse:
+        cached = CachedResponse(body, dict(headers or {}))
+        if self.backend is not None:
+            try:
+                await self.backend.set(self.key_for(request), cached, ttl or self.ttl, tags)
+            except Exception:
+                log.warning("Response cache write failed", exc_info=True)
+        return cached
+
+    async def generation(self, tag: str) -> Optional[int]:
+        """Counter bumped by every invalidation of ``tag``; None if unavailable."""
+        if self.backend is None:
+            return None
+        try:
+            return await self.backend.generation(tag)
+        except Exception:
+            log.warning("Response cache generation read failed", exc_info=True)
+            return None
+
+    async def set_if_current(
+        self,
+        request: Request,
+        body: bytes,
+        tags: Iterable[str],
+        headers: Optional[Dict[str, str]] = None,
+        ttl: Optional[float] = None,
+        *,
+        tag: str,
+        generation: Optional[int],
+    ) -> None:
+        """``set``, unless ``tag`` was invalidated since ``generation`` was read.
+
+        For bodies built over a long time (e.g. streamed): a write that
+        landed mid-build would otherwise be overwritten by the stale body.
+        The generation is checked again after the write to close the gap
+        between check and write.
+        """
+        if generation is None or await self.generation(tag) != generation:
+            return
+        await self.set(request, body, tags, headers, ttl)
+        if await self.generation(tag) != generation:
+            await self.invalidate(tag)
+
+    async def invalidate(self, *tags: str) -> None:
+        if self.backend is None or not tags:
+            return
+        try:
+            await self.backend.invalidate_tags(tags)
+        except Exception:
+            log.warning("Response cache invalidation failed", exc_info=True)
+
+    @staticmethod
+    def to_response(cached: CachedResponse, hit: bool) -> Response:
+        headers = dict(cached.headers)
+        headers["X-Cache"] = "HIT" if hit else "MISS"
+        return Response(content=cached.body, media_type="application/json", headers=headers)
+
+
+def _backend_from_settings():
+    if RESPONSE_CACHE_BACKEND == "none" or RESPONSE_CACHE_TTL <= 0:
+        return None
+    if RESPONSE_CACHE_BACKEND == "redis":
+        return RedisCacheBackend()
+    return InMemoryCacheBackend()
+
+
+response_cache = ResponseCache(_backend_from_settings())
+
+
+# --- Tags shared by the catalogue endpoints ---
+PRODUCT_LIST_TAG = "products"
+SITEMAP_TAG = "sitemap"
+
+
+def product_tag(product_id: int) -> str:
+    return f"product:{product_id}"
+
+
+def category_tag(category_id: int) -> str:
+    return f"category:{category_id}"
+
+
+async def invalidate_products(*product_ids: int) -> None:
+    """Drop product listings, sitemaps and the detail pages of ``product_ids``."""
+    await response_cache.invalidate(PRODUCT_LIST_TAG, SITEMAP_TAG, *[product_tag(i) for i in product_ids])
@@ -0,0 +1,64 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, Optional
+
+from fastapi import Request, Response
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Model timestamps are naive UTC (datetime.utcnow)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def validator_headers(
+    count: int,
+    last_modified: Optional[datetime],
+    ids: Iterable = (),
+    extra: str = "",
+) -> Dict[str, str]:
+    """Weak ETag / Last-Modified for a result set.
+
+    The ETag is built from the row count and newest ``updated_at``; a digest
+    of the row ids is folded in so deletes and reorders change it too.
+    """
+    stamp = _as_utc(last_modified).timestamp() if last_modified else 0
+    digest = hashlib.blake2b(
+        f"{','.join(map(str, ids))}|{extra}".encode(), digest_size=8
+    ).hexdigest()
+    headers = {
+        "ETag": f'W/"{count}-{stamp:.6f}-{digest}"',
+        "Cache-Control": "no-cache",
+    }
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(_as_utc(last_modified), usegmt=True)
+    return headers
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """Evaluate If-None-Match (preferred) or If-Modified-Since against ``headers``."""
+    if_none_match = request.headers.get("if-none-match")
+    etag = headers.get("ETag")
+    if if_none_match is not None and etag:
+        candidates = [t for t in if_none_match.split(",") if t.strip()]
+        return any(t.strip() == "*" or _opaque(t) == _opaque(etag) for t in candidates)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    last_modified = headers.get("Last-Modified")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,190 @@
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+# Label sets beyond this per metric are folded into a single "other" series,
+# so a bug or a hostile client can't grow the registry without bound.
+METRICS_MAX_SERIES = 500
+OTHER = "other"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (labels, value) pairs of one metric, as produced by a collector
+Samples = Iterable[Tuple[Dict[str, str], float]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), max_series: int = METRICS_MAX_SERIES):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self._series: Dict[tuple, object] = {}
+
+    def _key(self, labels: tuple) -> tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        labels = tuple(str(v) for v in labels)
+        if labels in self._series or len(self._series) < self.max_series:
+            return labels
+        return (OTHER,) * len(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._series.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        self._series[self._key(labels)] = value
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    render = Counter.render
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, max_series: int = METRICS_MAX_SERIES):
+        super().__init__(name, documentation, labelnames, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # per-bucket (non-cumulative) counts, the last one is +Inf; then sum
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metrics updated in place plus collectors read at scrape time.
+
+    A collector is ``fn() -> iterable of (name, kind, help, samples)``; it is
+    how stats objects that already keep their own counters (pool, hasher,
+    outbox, caches) are exported without touching their hot paths.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kw) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, **kw))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kw) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, **kw))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kw) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, **kw))
+
+    def collector(self, fn: Callable) -> Callable:
+        self._collectors.append(fn)
+        return fn
+
+    async def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for fn in self._collectors:
+            try:
+                families = fn()
+                if hasattr(families, "__await__"):
+                    families = await families
+                for name, kind, documentation, samples in families:
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for labels, value in samples:
+                        lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+            except Exception:
+                log.warning("Metrics collector %s failed", getattr(fn, "__name__", fn), exc_info=True)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# --- Metrics updated on the hot path ---
+HTTP_REQUESTS = metrics.counter(
+    "http_requests_total", "HTTP requests by route template, method and status class.",
+    ("route", "method", "status"),
+)
+HTTP_LATENCY = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template and method.",
+    ("route", "method"),
+)
+HTTP_IN_FLIGHT = metrics.gauge("http_requests_in_flight", "HTTP requests currently being handled.")
+DB_POOL_WAIT = metrics.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+MPESA_STK_PUSHES = metrics.counter(
+    "mpesa_stk_push_total", "STK push requests by Daraja response code.", ("response_code",), max_series=50,
+)
+MPESA_CALLBACKS = metrics.counter(
+    "mpesa_callbacks_total", "M-Pesa callbacks received by result code.", ("result_code",), max_series=50,
+)
+MPESA_CALLBACK_OUTCOMES = metrics.counter(
+    "mpesa_callback_outcomes_total", "Processed M-Pesa callbacks by outcome.", ("outcome",), max_series=20,
+)
@@ -0,0 +1,49 @@
+import base64
+import binascii
+import json
+from typing import Optional, Sequence
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import Select
+
+# Opaque cursor for the next page, returned as a response header so list
+# endpoints keep their plain JSON array bodies.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    raw = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded))["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def paginate(query: Select, id_column, skip: int, limit: int, cursor: Optional[str]) -> Select:
+    """Order by id and page with a keyset cursor, or with OFFSET when no cursor is given.
+
+    The cursor form seeks straight to ``id > last_id`` on the primary key
+    index, so deep pages cost the same as the first one.
+    """
+    query = query.order_by(id_column).limit(limit)
+    if cursor:
+        return query.where(id_column > decode_cursor(cursor))
+    return query.offset(skip)
+
+
+def next_cursor(rows: Sequence, limit: int) -> Optional[str]:
+    """Cursor for the page after ``rows``, or None when this was the last page."""
+    if rows and len(rows) == limit:
+        return encode_cursor(rows[-1].id)
+    return None
+
+
+def set_next_cursor(response: Response, rows: Sequence, limit: int) -> None:
+    cursor = next_cursor(rows, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor